@@ -0,0 +1,98 @@
+"""
+Micro-benchmark of VocaDB page decoding: the page is parsed and the song URL
+rows of its PVs are built (scrapers.vocaDBPages), once with the stdlib json
+parser and once with orjson, if it is installed.
+
+Usage:
+    python -m benchmarks.bench_decode --pages 200
+    python -m benchmarks.bench_decode --payload recorded_page.json
+
+--payload takes a recorded /api/songs response, otherwise synthetic pages are used.
+"""
+import argparse
+import json
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+from scrapers.vocaDBPages import orjson, song_urls_of
+
+from benchmarks.payloads import make_songs_page
+
+
+def page_path(parse: Callable[[bytes], Any]) -> Callable[[bytes], tuple]:
+    def decode(raw: bytes):
+        songs = parse(raw).get("items", [])
+        return (songs, song_urls_of(songs))
+    return decode
+
+
+def measure_memory(decode: Callable[[bytes], tuple], raw: bytes) -> Tuple[int, int]:
+    """
+    Peak memory while decoding one page and memory still held by its result.
+    """
+    # Warm up caches (e.g. orjson key cache), so they aren't counted as page memory
+    decode(raw)
+
+    tracemalloc.start()
+    kept = decode(raw)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return (peak, retained)
+
+
+def measure_round(decode: Callable[[bytes], tuple], payloads: List[bytes]) -> Tuple[float, float]:
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    for raw in payloads:
+        decode(raw)
+    return (time.perf_counter() - started, time.process_time() - cpu_started)
+
+
+def bench(paths: Dict[str, Callable[[bytes], tuple]], payloads: List[bytes], repeat: int):
+    """
+    Rounds of the paths alternate and the fastest round of each counts,
+    so neither is favoured by running first or by a noisy moment.
+    """
+    best = {name: (float("inf"), float("inf")) for name in paths}
+    for _ in range(repeat):
+        for name, decode in paths.items():
+            best[name] = min(best[name], measure_round(decode, payloads))
+
+    pages = len(payloads)
+    for name, decode in paths.items():
+        elapsed, cpu = best[name]
+        peak, retained = measure_memory(decode, payloads[0])
+        print(
+            f"{name:<8} {pages / elapsed:9.1f} pages/sec  "
+            f"{cpu / pages * 1000:7.3f} ms CPU/page  "
+            f"{peak / 1024:9.1f} KiB peak/page  "
+            f"{retained / 1024:9.1f} KiB retained/page"
+        )
+
+
+def main(args: argparse.Namespace):
+    if (args.payload):
+        with open(args.payload, "rb") as file:
+            payloads = [file.read()]
+    else:
+        payloads = [
+            json.dumps(make_songs_page(i * 100, total_count=args.pages * 100)).encode()
+            for i in range(args.pages)
+        ]
+
+    paths = {"json": page_path(json.loads)}
+    if (orjson is not None):
+        paths["orjson"] = page_path(orjson.loads)
+    else:
+        print("orjson isn't installed, only the stdlib parser is measured")
+    bench(paths, payloads, args.repeat)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--payload")
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    main(parser.parse_args())
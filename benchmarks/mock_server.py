@@ -0,0 +1,235 @@
+"""
+Local aiohttp server replaying VocaDB /api/songs pages, YouTube videos JSON,
+NicoNico getthumbinfo XML and Bilibili view JSON, with configurable latency,
+error rate and 429 rate.
+
+Usage:
+    python -m benchmarks.mock_server --port 8080 --latency-ms 50 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import json
+import random
+from dataclasses import dataclass
+
+from aiohttp import web
+
+from benchmarks.payloads import make_songs_page, make_song_by_id
+
+
+@dataclass
+class MockConfig:
+    total_songs: int = 10000
+    latency_ms: float = 0
+    latency_jitter_ms: float = 0
+    error_rate: float = 0
+    throttle_rate: float = 0
+    seed: int = 0
+
+
+# Paths of the mocked APIs, relative to the server root
+vocadb_path = "/api/songs"
+youtube_path = "/youtube/v3/videos"
+niconico_path = "/api/getthumbinfo/"
+bilibili_path = "/x/web-interface/view"
+
+
+class MockServer:
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.requests = 0
+
+        self.app = web.Application()
+        self.app.router.add_get(vocadb_path, self.vocadb_songs)
+        self.app.router.add_get(vocadb_path + "/{id}", self.vocadb_song)
+        self.app.router.add_get(youtube_path, self.youtube_videos)
+        self.app.router.add_get(niconico_path + "{vid}", self.niconico_thumbinfo)
+        self.app.router.add_get(bilibili_path, self.bilibili_view)
+
+        self._runner = None
+        self.base_url = ""
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if (self._runner is not None):
+            await self._runner.cleanup()
+
+    async def _delay(self):
+        delay = self.config.latency_ms + self.rng.uniform(0, self.config.latency_jitter_ms)
+        if (delay > 0):
+            await asyncio.sleep(delay / 1000)
+
+    def _roll(self, rate: float) -> bool:
+        return rate > 0 and self.rng.random() < rate
+
+    async def _common(self):
+        """
+        Returns an early response for throttled or failed requests.
+        """
+        self.requests += 1
+        await self._delay()
+        if (self._roll(self.config.throttle_rate)):
+            return web.Response(status=429, text="Too Many Requests")
+        return None
+
+    def _views(self, video_id: str) -> int:
+        return random.Random(video_id).randint(0, 10_000_000)
+
+    async def vocadb_songs(self, request: web.Request) -> web.Response:
+        early = await self._common()
+        if (early is not None):
+            return early
+        if (self._roll(self.config.error_rate)):
+            return web.Response(status=500, text="Internal Server Error")
+
+        start = int(request.query.get("start", 0))
+        size = int(request.query.get("maxResults", 100))
+        total = self.config.total_songs
+        if (request.query.get("sort") == "AdditionDate"):
+            # Newest first, ids grow with the addition date
+            items = [
+                make_song_by_id(song_id, total, self.config.seed)
+                for song_id in range(total - start, max(total - start - size, 0), -1)
+            ]
+            page = {"items": items, "term": "", "totalCount": total}
+        else:
+            page = make_songs_page(start, size, total, self.config.seed)
+        if (not request.query.get("fields")):
+            for item in page["items"]:
+                for key in ("additionalNames", "artists", "pvs", "tags"):
+                    item.pop(key)
+        return web.Response(body=json.dumps(page), content_type="application/json")
+
+    async def vocadb_song(self, request: web.Request) -> web.Response:
+        early = await self._common()
+        if (early is not None):
+            return early
+        if (self._roll(self.config.error_rate)):
+            return web.Response(status=500, text="Internal Server Error")
+
+        song_id = int(request.match_info["id"])
+        if (not 0 < song_id <= self.config.total_songs):
+            return web.Response(status=404, text="Not Found")
+        return web.json_response(make_song_by_id(song_id, self.config.total_songs, self.config.seed))
+
+    async def youtube_videos(self, request: web.Request) -> web.Response:
+        early = await self._common()
+        if (early is not None):
+            return early
+        if (self._roll(self.config.error_rate)):
+            return web.Response(status=500, text="backendError")
+
+        ids = [video_id for video_id in request.query.get("id", "").split(",") if video_id]
+        items = [
+            {
+                "kind": "youtube#video",
+                "id": video_id,
+                "statistics": {
+                    "viewCount": str(self._views(video_id)),
+                    "likeCount": str(self._views(video_id) // 50),
+                    "favoriteCount": "0",
+                    "commentCount": "12",
+                },
+            }
+            # A few videos are deleted, so they are missing from the response
+            for video_id in ids
+            if (self._views(video_id) % 20 != 0)
+        ]
+        return web.json_response({"kind": "youtube#videoListResponse", "items": items})
+
+    async def niconico_thumbinfo(self, request: web.Request) -> web.Response:
+        early = await self._common()
+        if (early is not None):
+            return early
+        if (self._roll(self.config.error_rate)):
+            return web.Response(text="<html>Service Unavailable</html>", content_type="text/html")
+
+        vid = request.match_info["vid"]
+        views = self._views(vid)
+        if (views % 20 == 0):
+            xml = (
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<nicovideo_thumb_response status="fail"><error><code>DELETED</code>'
+                '<description>deleted</description></error></nicovideo_thumb_response>'
+            )
+        else:
+            xml = (
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<nicovideo_thumb_response status="ok"><thumb>'
+                f'<video_id>{vid}</video_id><title>Song {vid}</title>'
+                f'<view_counter>{views}</view_counter><comment_num>10</comment_num>'
+                f'<mylist_counter>{views // 100}</mylist_counter>'
+                '</thumb></nicovideo_thumb_response>'
+            )
+        return web.Response(text=xml, content_type="application/xml")
+
+    async def bilibili_view(self, request: web.Request) -> web.Response:
+        early = await self._common()
+        if (early is not None):
+            return early
+        if (self._roll(self.config.error_rate)):
+            return web.json_response({"code": -412, "message": "request was banned", "ttl": 1})
+
+        bvid = request.query.get("bvid") or f"av{request.query.get('aid', '')}"
+        views = self._views(bvid)
+        if (views % 20 == 0):
+            return web.json_response({"code": 62002, "message": "invisible", "ttl": 1})
+        return web.json_response({
+            "code": 0,
+            "message": "0",
+            "ttl": 1,
+            "data": {
+                "bvid": bvid,
+                "stat": {
+                    "view": views,
+                    "like": views // 30,
+                    "dislike": 0,
+                    "favorite": views // 80,
+                },
+            },
+        })
+
+
+async def serve(config: MockConfig, port: int):
+    server = MockServer(config)
+    base_url = await server.start(port=port)
+    print(f"Mock server is listening on {base_url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--total-songs", type=int, default=10000)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--latency-jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--throttle-rate", type=float, default=0, help="Fraction of requests answered with 429")
+
+
+def mock_config_from_args(args: argparse.Namespace) -> MockConfig:
+    return MockConfig(
+        total_songs=args.total_songs,
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8080)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+    asyncio.run(serve(mock_config_from_args(args), args.port))
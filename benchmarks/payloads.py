@@ -0,0 +1,129 @@
+"""
+Synthetic VocaDB-shaped payloads for benchmarks.
+The shape mirrors /api/songs?fields=AdditionalNames,PVs,Artists,Bpm,Tags responses.
+"""
+import random
+from typing import List
+
+from utils.videoIds import canonical_video_id
+
+services = [
+    ("NicoNicoDouga", "http://www.nicovideo.jp/watch/sm{}"),
+    ("Youtube", "https://youtu.be/{}"),
+    ("Bilibili", "https://www.bilibili.com/video/av{}"),
+    ("Piapro", "https://piapro.jp/t/{}"),
+]
+
+
+def _youtube_id(rng: random.Random) -> str:
+    alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_-"
+    return "".join(rng.choice(alphabet) for _ in range(11))
+
+
+def make_pv(rng: random.Random, pv_id: int) -> dict:
+    service, url_format = rng.choice(services)
+    video_id = _youtube_id(rng) if (service == "Youtube") else rng.randint(1_000_000, 45_000_000)
+    return {
+        "author": f"author{rng.randint(1, 5000)}",
+        "disabled": False,
+        "id": pv_id,
+        "length": rng.randint(60, 600),
+        "name": f"PV {pv_id}",
+        "publishDate": f"20{rng.randint(8, 25):02d}-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}T00:00:00",
+        "pvType": rng.choice(["Original", "Reprint"]),
+        "service": service,
+        "thumbUrl": f"https://example.com/thumbs/{pv_id}.jpg",
+        "url": url_format.format(video_id),
+    }
+
+
+def make_song(rng: random.Random, song_id: int, pv_id_start: int) -> dict:
+    pvs = [make_pv(rng, pv_id_start + i) for i in range(rng.randint(0, 4))]
+    artist_ids = [rng.randint(1, 100_000) for _ in range(rng.randint(1, 4))]
+    tag_ids = [rng.randint(1, 10_000) for _ in range(rng.randint(0, 8))]
+    return {
+        "additionalNames": f"Song {song_id}, ソング {song_id}",
+        "artistString": " feat. ".join(f"artist{artist_id}" for artist_id in artist_ids[:2]),
+        "createDate": "2011-05-07T13:27:46.34",
+        "defaultName": f"Song {song_id}",
+        "defaultNameLanguage": "Japanese",
+        "favoritedTimes": rng.randint(0, 500),
+        "id": song_id,
+        "lengthSeconds": rng.randint(60, 600),
+        "name": f"Song {song_id}",
+        "publishDate": "2011-05-06T00:00:00Z",
+        "pvServices": ", ".join(sorted({pv["service"] for pv in pvs})) or "Nothing",
+        "ratingScore": rng.randint(0, 2000),
+        "songType": rng.choice(["Original", "Cover", "Remix"]),
+        "status": "Finished",
+        "version": rng.randint(1, 40),
+        "minMilliBpm": 120000,
+        "maxMilliBpm": 180000,
+        "artists": [
+            {
+                "artist": {
+                    "additionalNames": "",
+                    "artistType": rng.choice(["Producer", "Vocaloid"]),
+                    "id": artist_id,
+                    "name": f"artist{artist_id}",
+                    "status": "Finished",
+                    "version": 1,
+                },
+                "categories": "Producer",
+                "effectiveRoles": "Default",
+                "isSupport": False,
+                "name": f"artist{artist_id}",
+                "roles": "Default",
+            }
+            for artist_id in artist_ids
+        ],
+        "pvs": pvs,
+        "tags": [
+            {
+                "count": rng.randint(1, 20),
+                "tag": {
+                    "additionalNames": "",
+                    "categoryName": "Genres",
+                    "id": tag_id,
+                    "name": f"tag{tag_id}",
+                    "urlSlug": f"tag{tag_id}",
+                },
+            }
+            for tag_id in tag_ids
+        ],
+    }
+
+
+def make_songs_page(start: int, size: int = 100, total_count: int = 100_000, seed: int = 0) -> dict:
+    """
+    Deterministic page of songs with ids start + 1 ... start + size.
+    """
+    rng = random.Random(seed + start)
+    items = [
+        make_song(rng, song_id, song_id * 10)
+        for song_id in range(start + 1, min(start + size, total_count) + 1)
+    ]
+    return {"items": items, "term": "", "totalCount": total_count}
+
+
+def make_song_by_id(song_id: int, total_count: int = 100_000, seed: int = 0, page_size: int = 100) -> dict:
+    """
+    The song song_id has on make_songs_page pages of page_size.
+    """
+    start = (song_id - 1) // page_size * page_size
+    return make_songs_page(start, page_size, total_count, seed)["items"][song_id - 1 - start]
+
+
+def song_urls_from_items(items: List[dict]) -> List[dict]:
+    return [
+        {
+            "pv_id": pv["id"],
+            "song_id": item["id"],
+            "url": pv["url"],
+            "service": pv["service"],
+            "video_id": canonical_video_id(pv["service"], pv["url"]),
+            "published_at": pv.get("publishDate", None),
+        }
+        for item in items
+        for pv in item["pvs"]
+    ]
@@ -4,4 +4,16 @@ class ResponseState(Enum):
     UNKNOWN = 0
     SUCCESS = 1
     DELETED = 2
-    NOT_FOUND = 3
\ No newline at end of file
+    NOT_FOUND = 3
+
+class FailureReason(Enum):
+    """
+    Why a video came back as ResponseState.UNKNOWN, stored in songurls.last_error.
+    """
+    TIMEOUT = "timeout"
+    NETWORK = "network"
+    HTTP_STATUS = "http_status"
+    PARSE = "parse"
+    BLOCKED = "blocked"
+    UNEXPECTED = "unexpected"
+
@@ -1,20 +1,52 @@
-from datetime import datetime
-from typing import Optional, List, Dict, Any, AsyncGenerator
+import json
+import math
+import re
+import time
+from datetime import datetime, date
+from typing import Optional, List, Dict, Any, AsyncGenerator, Tuple
 
-from sqlalchemy import String, Integer, DateTime, Index, ForeignKey, BigInteger
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import String, Integer, DateTime, Index, ForeignKey, BigInteger, Float, Boolean, JSON, event
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.dialects.postgresql import JSONB, insert as pg_insert, aggregate_order_by
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.asyncio import (
     AsyncSession,
     create_async_engine,
     async_sessionmaker,
 )
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import select, update, case, and_, func
+from sqlalchemy import select, update, delete, insert, case, and_, func, text, values, cast, literal_column, bindparam
+from sqlalchemy import column as sa_column
 
 from collections import defaultdict
 
 from constants.services import Service, service_names_map
 
+from db.sqlFunctions import db_now, seconds_from_now, days_since, greatest, least, json_array_length, desc_nulls_last
+
+from utils.videoIds import canonical_video_id
+from utils.metrics import db_commit_duration
+from utils.profiling import span
+
+
+class _SQLiteDateTime(TypeDecorator):
+    """
+    VocaDB dates arrive as ISO strings, PostgreSQL casts them itself
+    but SQLAlchemy's SQLite DateTime only binds datetime objects.
+    """
+    impl = DateTime
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if (isinstance(value, str)):
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None)
+        return value
+
+
+# JSONB on PostgreSQL, JSON1 text on SQLite
+JSONColumn = JSONB().with_variant(JSON(), "sqlite")
+TimestampColumn = DateTime(timezone=False).with_variant(_SQLiteDateTime(), "sqlite")
+
 
 # --- SQLAlchemy Base ---
 class Base(DeclarativeBase):
@@ -24,6 +56,13 @@ class Base(DeclarativeBase):
 # --- Song Model ---
 class Song(Base):
     __tablename__ = "songs"
+    __table_args__ = (
+        # Back "top N songs" and view thresholds, see _SONG_VIEW_TOTAL_COLUMNS
+        Index("ix_songs_total_views", desc_nulls_last(text('"totalViews"'))),
+        Index("ix_songs_youtube_views", desc_nulls_last(text('"youtubeViews"'))),
+        Index("ix_songs_niconico_views", desc_nulls_last(text('"niconicoViews"'))),
+        Index("ix_songs_bilibili_views", desc_nulls_last(text('"bilibiliViews"'))),
+    )
 
     # Required fields
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
@@ -40,69 +79,693 @@ class Song(Base):
     favoritedTimes: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
     ratingScore: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
     createDate: Mapped[Optional[datetime]] = mapped_column(
-        DateTime(timezone=False), nullable=True
+        TimestampColumn, nullable=True
     )
     publishDate: Mapped[Optional[datetime]] = mapped_column(
-        DateTime(timezone=False), nullable=True
+        TimestampColumn, nullable=True
     )
     status: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     version: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
 
     # JSON fields
-    additionalNames: Mapped[Optional[Any]] = mapped_column(JSONB, nullable=True)
-    pvs: Mapped[Optional[Any]] = mapped_column(JSONB, nullable=True)
-    views: Mapped[Optional[Any]] = mapped_column(JSONB, nullable=True)
-    artists: Mapped[Optional[Any]] = mapped_column(JSONB, nullable=True)
-    tags: Mapped[Optional[Any]] = mapped_column(JSONB, nullable=True)
+    additionalNames: Mapped[Optional[Any]] = mapped_column(JSONColumn, nullable=True)
+    pvs: Mapped[Optional[Any]] = mapped_column(JSONColumn, nullable=True)
+    views: Mapped[Optional[Any]] = mapped_column(JSONColumn, nullable=True)
+    artists: Mapped[Optional[Any]] = mapped_column(JSONColumn, nullable=True)
+    tags: Mapped[Optional[Any]] = mapped_column(JSONColumn, nullable=True)
+
+    # Sums of songurls.views, kept up to date by every statistics write
+    totalViews: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    youtubeViews: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    niconicoViews: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    bilibiliViews: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
 
 
 class SongURL(Base):
     __tablename__ = "songurls"
+    __table_args__ = (
+        # VocaDB PV ids are global, so they identify a song URL across crawls
+        Index("ix_songurls_pv_id", "pv_id", unique=True),
+        # Backs the per-service keyset cursor over rows without statistics
+        Index(
+            "ix_songurls_unprocessed",
+            "service",
+            "id",
+            postgresql_where=text("views IS NULL"),
+            sqlite_where=text("views IS NULL")
+        ),
+        Index("ix_songurls_service_video_id", "service", "video_id"),
+        # Backs the per-service keyset cursor over distinct videos without statistics
+        Index(
+            "ix_songurls_unprocessed_video_id",
+            "service",
+            "video_id",
+            postgresql_where=text("views IS NULL"),
+            sqlite_where=text("views IS NULL")
+        ),
+        # Backs the refresh scheduler, which leases the most overdue videos first
+        Index(
+            "ix_songurls_refresh_due",
+            "service",
+            "next_refresh_at",
+            postgresql_where=text("views IS NOT NULL"),
+            sqlite_where=text("views IS NOT NULL")
+        ),
+    )
 
-    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    # SQLite only autoincrements INTEGER PRIMARY KEY columns
+    id: Mapped[int] = mapped_column(
+        BigInteger().with_variant(Integer, "sqlite"),
+        primary_key=True,
+        autoincrement=True
+    )
     pv_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
     song_id: Mapped[int] = mapped_column(ForeignKey("songs.id"), nullable=False)
     url: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     service: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    # Canonical id of the video inside its service, see utils.videoIds
+    video_id: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     views: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
     likes: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
     dislikes: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
     favorites: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
     published_at: Mapped[Optional[datetime]] = mapped_column(
-        DateTime(timezone=False), 
+        TimestampColumn, 
+        nullable=True
+    )
+    # Set while a worker holds the row, see SongRepository.lease_video_ids
+    lease_owner: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    leased_until: Mapped[Optional[datetime]] = mapped_column(
+        TimestampColumn,
+        nullable=True
+    )
+    # Retry budget of failed fetches, see SongRepository.record_fetch_failures
+    fetch_attempts: Mapped[int] = mapped_column(Integer, nullable=False, server_default=text("0"))
+    last_error: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    next_attempt_at: Mapped[Optional[datetime]] = mapped_column(
+        TimestampColumn,
+        nullable=True
+    )
+    dead_lettered_at: Mapped[Optional[datetime]] = mapped_column(
+        TimestampColumn,
+        nullable=True
+    )
+    # Refresh schedule, see _refresh_schedule_values
+    refreshed_at: Mapped[Optional[datetime]] = mapped_column(
+        TimestampColumn,
+        nullable=True
+    )
+    views_per_day: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    next_refresh_at: Mapped[Optional[datetime]] = mapped_column(
+        TimestampColumn,
         nullable=True
     )
     created_at: Mapped[datetime] = mapped_column(
-        DateTime(timezone=False), 
+        TimestampColumn, 
         server_default=func.now()
     )
     updated_at: Mapped[datetime] = mapped_column(
-        DateTime(timezone=False), 
+        TimestampColumn, 
+        server_default=func.now(),
+        onupdate=func.now()
+    )
+
+
+# --- SongURL Statistics History Model ---
+class SongURLStatsSnapshot(Base):
+    """
+    Append-only statistics of song URLs, one row per URL per refresh.
+    Range-partitioned by month on captured_at, see ensure_stats_history_partitions.
+    """
+    __tablename__ = "songurl_stats_history"
+    __table_args__ = (
+        # Append-only rows are physically ordered by time, so BRIN stays tiny
+        Index(
+            "ix_songurl_stats_history_captured_at",
+            "captured_at",
+            postgresql_using="brin"
+        ),
+        {"postgresql_partition_by": "RANGE (captured_at)"},
+    )
+
+    songurl_id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False)
+    captured_at: Mapped[datetime] = mapped_column(
+        TimestampColumn,
+        primary_key=True,
+        server_default=func.now()
+    )
+    views: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    likes: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    dislikes: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    favorites: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+
+
+# --- Normalized Catalogue Models ---
+class Artist(Base):
+    __tablename__ = "artists"
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False)
+    name: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    artist_type: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+
+
+class Tag(Base):
+    __tablename__ = "tags"
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False)
+    name: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    category_name: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    url_slug: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+
+
+class SongArtist(Base):
+    """
+    Credited artists of a song, mirrors the registered entries of Song.artists.
+    """
+    __tablename__ = "song_artists"
+    __table_args__ = (
+        Index("ix_song_artists_artist_id", "artist_id"),
+    )
+
+    song_id: Mapped[int] = mapped_column(ForeignKey("songs.id"), primary_key=True)
+    artist_id: Mapped[int] = mapped_column(ForeignKey("artists.id"), primary_key=True)
+    categories: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    roles: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    is_support: Mapped[Optional[bool]] = mapped_column(Boolean, nullable=True)
+
+
+class SongTag(Base):
+    """
+    Tags of a song with their vote counts, mirrors Song.tags.
+    """
+    __tablename__ = "song_tags"
+    __table_args__ = (
+        Index("ix_song_tags_tag_id", "tag_id"),
+    )
+
+    song_id: Mapped[int] = mapped_column(ForeignKey("songs.id"), primary_key=True)
+    tag_id: Mapped[int] = mapped_column(ForeignKey("tags.id"), primary_key=True)
+    count: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+
+
+# --- Crawl Checkpoint Model ---
+class CrawlCheckpoint(Base):
+    __tablename__ = "crawl_checkpoints"
+
+    page_start: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False)
+    page_size: Mapped[int] = mapped_column(Integer, nullable=False)
+    songs_count: Mapped[int] = mapped_column(Integer, nullable=False)
+    completed_at: Mapped[datetime] = mapped_column(
+        TimestampColumn,
         server_default=func.now(),
         onupdate=func.now()
     )
 
 
+# Columns of Song that are not part of the VocaDB payload and must survive re-crawls
+_SONG_VIEW_TOTAL_COLUMNS = {
+    "youtubeViews": service_names_map[Service.YOUTUBE],
+    "niconicoViews": service_names_map[Service.NICONICO],
+    "bilibiliViews": service_names_map[Service.BILIBILI],
+}
+_SONG_DERIVED_COLUMNS = {"views", "totalViews", *_SONG_VIEW_TOTAL_COLUMNS}
+_SONG_PAYLOAD_COLUMNS = [
+    column.key for column in Song.__table__.columns
+    if column.key not in _SONG_DERIVED_COLUMNS
+]
+_SONG_URL_PAYLOAD_COLUMNS = ["pv_id", "song_id", "url", "service", "video_id", "published_at"]
+_SONG_URL_STATS_COLUMNS = ["views", "likes", "dislikes", "favorites"]
+_SONG_JSON_COLUMNS = {
+    column.key for column in Song.__table__.columns
+    if isinstance(column.type, JSONB)
+}
+
+# Statements preparing an index of _MIGRATIONS, run right before the migration
+# creating it and only while that index doesn't exist
+_INDEX_PREREQUISITES = {
+    # Drop duplicated rows left by non-idempotent runs so the unique index can be built
+    "ix_songurls_pv_id": [
+        """
+        DELETE FROM songurls a
+        USING songurls b
+        WHERE a.pv_id = b.pv_id AND a.id > b.id
+        """,
+    ],
+    # Statistics written before the scheduler existed are due right away, oldest first
+    "ix_songurls_refresh_due": [
+        "UPDATE songurls SET refreshed_at = updated_at, next_refresh_at = updated_at WHERE views IS NOT NULL AND refreshed_at IS NULL",
+    ],
+}
+_CREATE_INDEX = re.compile(r"CREATE (?:UNIQUE )?INDEX IF NOT EXISTS (\w+)")
+
+# Idempotent statements for databases created before the corresponding model changes
+_MIGRATIONS = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_songurls_pv_id ON songurls (pv_id)",
+    "CREATE INDEX IF NOT EXISTS ix_songurls_unprocessed ON songurls (service, id) WHERE views IS NULL",
+    "ALTER TABLE songurls ADD COLUMN IF NOT EXISTS video_id VARCHAR",
+    "CREATE INDEX IF NOT EXISTS ix_songurls_service_video_id ON songurls (service, video_id)",
+    "CREATE INDEX IF NOT EXISTS ix_songurls_unprocessed_video_id ON songurls (service, video_id) WHERE views IS NULL",
+    "ALTER TABLE songurls ADD COLUMN IF NOT EXISTS lease_owner VARCHAR",
+    "ALTER TABLE songurls ADD COLUMN IF NOT EXISTS leased_until TIMESTAMP WITHOUT TIME ZONE",
+    "ALTER TABLE songurls ADD COLUMN IF NOT EXISTS fetch_attempts INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE songurls ADD COLUMN IF NOT EXISTS last_error VARCHAR",
+    "ALTER TABLE songurls ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMP WITHOUT TIME ZONE",
+    "ALTER TABLE songurls ADD COLUMN IF NOT EXISTS dead_lettered_at TIMESTAMP WITHOUT TIME ZONE",
+    "ALTER TABLE songurls ADD COLUMN IF NOT EXISTS refreshed_at TIMESTAMP WITHOUT TIME ZONE",
+    "ALTER TABLE songurls ADD COLUMN IF NOT EXISTS views_per_day DOUBLE PRECISION",
+    "ALTER TABLE songurls ADD COLUMN IF NOT EXISTS next_refresh_at TIMESTAMP WITHOUT TIME ZONE",
+    "CREATE INDEX IF NOT EXISTS ix_songurls_refresh_due ON songurls (service, next_refresh_at) WHERE views IS NOT NULL",
+    *(
+        f'ALTER TABLE songs ADD COLUMN IF NOT EXISTS "{column}" BIGINT'
+        for column in ("totalViews", *_SONG_VIEW_TOTAL_COLUMNS)
+    ),
+    *(
+        f'CREATE INDEX IF NOT EXISTS ix_songs_{column[:-5]}_views ON songs ("{column}" DESC NULLS LAST)'
+        for column in ("totalViews", *_SONG_VIEW_TOTAL_COLUMNS)
+    ),
+]
+
+# A successful statistics write ends the lease and the retry budget of a row
+_STATS_WRITE_RESETS = {
+    "lease_owner": None,
+    "leased_until": None,
+    "fetch_attempts": 0,
+    "last_error": None,
+    "next_attempt_at": None,
+    "dead_lettered_at": None,
+}
+
+# Refresh intervals grow with the age of a video and shrink with its views per day
+_REFRESH_MIN_DAYS = 0.25
+_REFRESH_MAX_DAYS = 90
+_REFRESH_AGE_FACTOR = 0.1
+
+
+def _eligible_for_fetch():
+    """
+    Rows that are neither dead-lettered nor backing off after a failed fetch.
+    """
+    return and_(
+        SongURL.dead_lettered_at.is_(None),
+        (SongURL.next_attempt_at.is_(None)) | (SongURL.next_attempt_at <= db_now())
+    )
+
+
+def _written_videos(service_name: str, updates: List[dict]):
+    """
+    Rows of service_name that belong to the videos of updates.
+    """
+    return and_(
+        SongURL.service == service_name,
+        SongURL.video_id.in_([upd["video_id"] for upd in updates])
+    )
+
+
+def _refresh_schedule_values(new_views) -> Dict[str, Any]:
+    """
+    SET clauses of a statistics write that schedule the next refresh of a row.
+    Velocity is the views gained per day since the previous refresh, or the
+    lifetime average on the first one. The next refresh comes after
+    age * _REFRESH_AGE_FACTOR / (1 + log10(1 + velocity)) days, clamped between
+    _REFRESH_MIN_DAYS and _REFRESH_MAX_DAYS, so new and trending videos are
+    revisited often and old quiet ones rarely.
+    """
+    age_days = greatest(days_since(func.coalesce(SongURL.published_at, SongURL.created_at)), 1)
+    elapsed_days = greatest(days_since(SongURL.refreshed_at), 1 / 24)
+    velocity = case(
+        (new_views.is_(None), SongURL.views_per_day),
+        (
+            and_(SongURL.views.is_not(None), SongURL.refreshed_at.is_not(None)),
+            greatest(new_views - SongURL.views, 0) / elapsed_days
+        ),
+        else_=new_views / age_days
+    )
+    interval_days = least(
+        _REFRESH_MAX_DAYS,
+        greatest(
+            _REFRESH_MIN_DAYS,
+            age_days * _REFRESH_AGE_FACTOR / (1 + func.log(1 + func.coalesce(velocity, 0)))
+        )
+    )
+    return {
+        "refreshed_at": db_now(),
+        "views_per_day": velocity,
+        "next_refresh_at": seconds_from_now(interval_days * 86400),
+    }
+
+
+def _month_start(day: date, months: int = 0) -> date:
+    month_index = day.year * 12 + day.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def _quote(column: str) -> str:
+    return f'"{column}"'
+
+
+def _upsert_from_staging_sql(table: str, staging: str, columns: List[str], key: str) -> str:
+    column_list = ", ".join(_quote(column) for column in columns)
+    assignments = ", ".join(
+        f"{_quote(column)} = EXCLUDED.{_quote(column)}"
+        for column in columns
+        if column != key
+    )
+    return (
+        f"INSERT INTO {table} ({column_list}) "
+        f"SELECT {column_list} FROM {staging} "
+        f"ON CONFLICT ({_quote(key)}) DO UPDATE SET {assignments}"
+    )
+
+
+def _catalogue_sync_sql(songs_filter: str, links_filter: str) -> List[str]:
+    """
+    Statements filling artists, tags, song_artists and song_tags from Song.artists
+    and Song.tags. songs_filter restricts the songs alias s, links_filter the
+    link rows replaced. Credits of unregistered artists have no id and only stay
+    inside Song.artists.
+    """
+    artist_credits = f"""
+        FROM songs s
+        CROSS JOIN jsonb_array_elements(COALESCE(s.artists, '[]'::jsonb)) a
+        {songs_filter}{" AND" if songs_filter else "WHERE"} a->'artist'->>'id' IS NOT NULL
+    """
+    tag_usages = f"""
+        FROM songs s
+        CROSS JOIN jsonb_array_elements(COALESCE(s.tags, '[]'::jsonb)) t
+        {songs_filter}{" AND" if songs_filter else "WHERE"} t->'tag'->>'id' IS NOT NULL
+    """
+    # Ordered inserts keep lock order stable between concurrent writers
+    return [
+        f"""
+        INSERT INTO artists (id, name, artist_type)
+        SELECT DISTINCT ON (artist_id) artist_id, name, artist_type FROM (
+            SELECT (a->'artist'->>'id')::bigint AS artist_id, a->'artist'->>'name' AS name,
+                a->'artist'->>'artistType' AS artist_type
+            {artist_credits}
+        ) credits
+        ORDER BY artist_id
+        ON CONFLICT (id) DO UPDATE SET name = EXCLUDED.name, artist_type = EXCLUDED.artist_type
+        """,
+        f"""
+        INSERT INTO tags (id, name, category_name, url_slug)
+        SELECT DISTINCT ON (tag_id) tag_id, name, category_name, url_slug FROM (
+            SELECT (t->'tag'->>'id')::bigint AS tag_id, t->'tag'->>'name' AS name,
+                t->'tag'->>'categoryName' AS category_name, t->'tag'->>'urlSlug' AS url_slug
+            {tag_usages}
+        ) usages
+        ORDER BY tag_id
+        ON CONFLICT (id) DO UPDATE SET
+            name = EXCLUDED.name, category_name = EXCLUDED.category_name, url_slug = EXCLUDED.url_slug
+        """,
+        f"DELETE FROM song_artists {links_filter}",
+        f"DELETE FROM song_tags {links_filter}",
+        f"""
+        INSERT INTO song_artists (song_id, artist_id, categories, roles, is_support)
+        SELECT DISTINCT ON (s.id, (a->'artist'->>'id')::bigint)
+            s.id, (a->'artist'->>'id')::bigint, a->>'categories', a->>'roles', (a->>'isSupport')::boolean
+        {artist_credits}
+        ORDER BY s.id, (a->'artist'->>'id')::bigint
+        """,
+        f"""
+        INSERT INTO song_tags (song_id, tag_id, count)
+        SELECT DISTINCT ON (s.id, (t->'tag'->>'id')::bigint)
+            s.id, (t->'tag'->>'id')::bigint, (t->>'count')::int
+        {tag_usages}
+        ORDER BY s.id, (t->'tag'->>'id')::bigint
+        """,
+    ]
+
+
+def _sqlite_catalogue_sync_sql(songs_filter: str, links_filter: str) -> List[str]:
+    """
+    SQLite spelling of _catalogue_sync_sql, over json_each instead of jsonb_array_elements.
+    """
+    artist_credits = f"""
+        FROM songs s, json_each(COALESCE(s.artists, '[]')) a
+        {songs_filter}{" AND" if songs_filter else "WHERE"} json_extract(a.value, '$.artist.id') IS NOT NULL
+    """
+    tag_usages = f"""
+        FROM songs s, json_each(COALESCE(s.tags, '[]')) t
+        {songs_filter}{" AND" if songs_filter else "WHERE"} json_extract(t.value, '$.tag.id') IS NOT NULL
+    """
+    return [
+        f"""
+        INSERT INTO artists (id, name, artist_type)
+        SELECT json_extract(a.value, '$.artist.id') AS artist_id, json_extract(a.value, '$.artist.name'),
+            json_extract(a.value, '$.artist.artistType')
+        {artist_credits}
+        GROUP BY artist_id
+        ON CONFLICT (id) DO UPDATE SET name = excluded.name, artist_type = excluded.artist_type
+        """,
+        f"""
+        INSERT INTO tags (id, name, category_name, url_slug)
+        SELECT json_extract(t.value, '$.tag.id') AS tag_id, json_extract(t.value, '$.tag.name'),
+            json_extract(t.value, '$.tag.categoryName'), json_extract(t.value, '$.tag.urlSlug')
+        {tag_usages}
+        GROUP BY tag_id
+        ON CONFLICT (id) DO UPDATE SET
+            name = excluded.name, category_name = excluded.category_name, url_slug = excluded.url_slug
+        """,
+        f"DELETE FROM song_artists {links_filter}",
+        f"DELETE FROM song_tags {links_filter}",
+        f"""
+        INSERT INTO song_artists (song_id, artist_id, categories, roles, is_support)
+        SELECT s.id, json_extract(a.value, '$.artist.id') AS artist_id, json_extract(a.value, '$.categories'),
+            json_extract(a.value, '$.roles'), json_extract(a.value, '$.isSupport')
+        {artist_credits}
+        GROUP BY s.id, artist_id
+        """,
+        f"""
+        INSERT INTO song_tags (song_id, tag_id, count)
+        SELECT s.id, json_extract(t.value, '$.tag.id') AS tag_id, json_extract(t.value, '$.count')
+        {tag_usages}
+        GROUP BY s.id, tag_id
+        """,
+    ]
+
+
+# Applied to every SQLite connection. WAL lets readers run next to the single
+# writer and makes synchronous=NORMAL safe against application crashes
+_SQLITE_PRAGMAS = [
+    "journal_mode=WAL",
+    "synchronous=NORMAL",
+    "foreign_keys=ON",
+    "busy_timeout=30000",
+    "temp_store=MEMORY",
+    "cache_size=-65536",
+    "mmap_size=268435456",
+]
+
+
+def _configure_sqlite_connection(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in _SQLITE_PRAGMAS:
+        cursor.execute(f"PRAGMA {pragma}")
+    try:
+        cursor.execute("SELECT log(10), power(2, 1)")
+    except Exception:
+        # SQLite built without its math functions, as used by the refresh schedule and backoff
+        dbapi_connection.create_function("log", 1, math.log10, deterministic=True)
+        dbapi_connection.create_function("power", 2, math.pow, deterministic=True)
+    cursor.close()
+
+
+def _dedupe_by_key(rows: List[dict], key: str) -> List[dict]:
+    """
+    ON CONFLICT DO UPDATE can't touch the same row twice in one statement,
+    so only the last occurrence of each key is kept.
+    """
+    return list({row[key]: row for row in rows}.values())
+
+
 # --- Repository Class ---
 class SongRepository:
     def __init__(self, db_url: str, echo: bool = False):
+        """
+        db_url picks the backend, either PostgreSQL (postgresql+psycopg://...) or
+        an embedded SQLite file (sqlite+aiosqlite:///songs.db, requires aiosqlite).
+        """
         self.engine = create_async_engine(db_url, echo=echo)
         self.session_factory = async_sessionmaker(self.engine, expire_on_commit=False)
 
+        self.sqlite = (self.engine.dialect.name == "sqlite")
+        self._insert = sqlite_insert if (self.sqlite) else pg_insert
+        if (self.sqlite):
+            event.listen(self.engine.sync_engine, "connect", _configure_sqlite_connection)
+
         # Internal states for batching
         self._last_id = -1
         self._last_ids = defaultdict(lambda: -1)
+        self._last_video_ids = defaultdict(str)
+
+    async def __aenter__(self) -> "SongRepository":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        """
+        Closes the pooled connections, open SQLite connections would keep the process alive.
+        """
+        await self.engine.dispose()
+
+    async def _commit(self, session: AsyncSession, operation: str):
+        started = time.perf_counter()
+        with span(f"db.commit.{operation}"):
+            await session.commit()
+        db_commit_duration.observe(time.perf_counter() - started, operation=operation)
 
     async def init_models(self):
-        """Create tables if they don't exist."""
+        """Create tables if they don't exist and apply pending migrations."""
         async with self.engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
+            # SQLite files are always created from the current models
+            if (not self.sqlite):
+                missing = set()
+                for index in _INDEX_PREREQUISITES:
+                    exists = await conn.execute(
+                        text("SELECT 1 FROM pg_indexes WHERE schemaname = current_schema() AND indexname = :index"),
+                        {"index": index}
+                    )
+                    if (exists.first() is None):
+                        missing.add(index)
+                for statement in _MIGRATIONS:
+                    created = _CREATE_INDEX.match(statement)
+                    if (created is not None and created.group(1) in missing):
+                        for prerequisite in _INDEX_PREREQUISITES[created.group(1)]:
+                            await conn.execute(text(prerequisite))
+                    await conn.execute(text(statement))
+        await self.ensure_stats_history_partitions()
+
+    async def ensure_stats_history_partitions(self, months_ahead: int = 2):
+        """
+        Creates monthly partitions of songurl_stats_history from the current month
+        up to months_ahead months later, plus a default one for anything outside of them.
+        Months that rows already reached in the default partition (e.g. during a long
+        run) get their partition too, with those rows moved in, PostgreSQL refuses
+        the partition while the default one holds matching rows.
+        On SQLite the history is a plain table.
+        """
+        if (self.sqlite):
+            return
+
+        table = SongURLStatsSnapshot.__tablename__
+        default = f"{table}_default"
+        async with self.engine.begin() as conn:
+            # Workers starting together would race for the same partitions
+            await conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:table))"), {"table": table})
+            # captured_at is set by the database, so its calendar decides the month
+            today = (await conn.execute(text("SELECT CURRENT_DATE"))).scalar_one()
+            await conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {default} PARTITION OF {table} DEFAULT"
+            ))
+            stray_months = await conn.execute(text(
+                f"SELECT DISTINCT CAST(date_trunc('month', captured_at) AS date) FROM {default}"
+            ))
+            starts = {_month_start(today, months) for months in range(months_ahead + 1)}
+            starts.update(stray_months.scalars().all())
+            for start in sorted(starts):
+                end = _month_start(start, 1)
+                partition = f"{table}_{start:%Y_%m}"
+                exists = await conn.execute(text("SELECT to_regclass(:partition)"), {"partition": partition})
+                if (exists.scalar_one() is not None):
+                    continue
+
+                bounds = f"captured_at >= '{start.isoformat()}' AND captured_at < '{end.isoformat()}'"
+                moved = f"{partition}_moved"
+                await conn.execute(text(
+                    f"CREATE TEMPORARY TABLE {moved} ON COMMIT DROP AS SELECT * FROM {default} WHERE {bounds}"
+                ))
+                await conn.execute(text(f"DELETE FROM {default} WHERE {bounds}"))
+                await conn.execute(text(
+                    f"CREATE TABLE {partition} PARTITION OF {table} "
+                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                ))
+                await conn.execute(text(f"INSERT INTO {table} SELECT * FROM {moved}"))
 
     async def insert_songs(self, songs: List[dict]):
+        """
+        Upserts songs by id. Derived columns (e.g. views) are left untouched on conflict.
+        """
+        if (not songs):
+            return
+
+        with span("db.insert_songs.rows"):
+            rows = _dedupe_by_key(
+                [{column: song.get(column) for column in _SONG_PAYLOAD_COLUMNS} for song in songs],
+                "id"
+            )
+
         async with self.session_factory() as session:
-            song_objects = [Song(**song) for song in songs]
-            session.add_all(song_objects)
-            await session.commit()
+            await session.execute(self._songs_upsert(), rows)
+            await self._sync_catalogue(session, songs)
+            await self._commit(session, "insert_songs")
+
+    def _songs_upsert(self):
+        stmt = self._insert(Song)
+        return stmt.on_conflict_do_update(
+            index_elements=[Song.id],
+            set_={
+                column: stmt.excluded[column]
+                for column in _SONG_PAYLOAD_COLUMNS
+                if column != "id"
+            }
+        )
+
+    def _song_urls_upsert(self):
+        stmt = self._insert(SongURL)
+        return stmt.on_conflict_do_update(
+            index_elements=[SongURL.pv_id],
+            set_={
+                column: stmt.excluded[column]
+                for column in _SONG_URL_PAYLOAD_COLUMNS
+                if column != "pv_id"
+            }
+        )
+
+    async def _sync_catalogue(self, session: AsyncSession, songs: List[dict]):
+        """
+        Upserts artists and tags of the just written songs and replaces their
+        song_artists and song_tags rows, all computed server-side from the JSONB columns.
+        """
+        song_ids = list({song.get("id") for song in songs})
+        if (not song_ids):
+            return
+        if (self.sqlite):
+            for statement in _sqlite_catalogue_sync_sql("WHERE s.id IN :song_ids", "WHERE song_id IN :song_ids"):
+                await session.execute(
+                    text(statement).bindparams(bindparam("song_ids", expanding=True)),
+                    {"song_ids": song_ids}
+                )
+            return
+        for statement in _catalogue_sync_sql("WHERE s.id = ANY(:song_ids)", "WHERE song_id = ANY(:song_ids)"):
+            await session.execute(text(statement), {"song_ids": song_ids})
+
+    async def rebuild_catalogue(self):
+        """
+        Rebuilds artists, tags, song_artists and song_tags from every song in one
+        transaction, e.g. for songs crawled before the tables existed.
+        """
+        sync_sql = _sqlite_catalogue_sync_sql if (self.sqlite) else _catalogue_sync_sql
+        async with self.engine.begin() as conn:
+            for statement in sync_sql("", ""):
+                await conn.execute(text(statement))
+
+    async def ensure_jsonb_gin_indexes(self):
+        """
+        Optional GIN indexes on Song.artists and Song.tags for containment queries
+        (e.g. artists @> '[{"artist": {"id": 1}}]'). They slow down song upserts,
+        so they are only built on request. SQLite has no GIN indexes, it's a no-op there.
+        """
+        if (self.sqlite):
+            return
+
+        async with self.engine.begin() as conn:
+            for column in ("artists", "tags"):
+                await conn.execute(text(
+                    f"CREATE INDEX IF NOT EXISTS ix_songs_{column}_gin ON songs USING gin ({column} jsonb_path_ops)"
+                ))
 
     async def insert_song(self, song: dict):
         await self.insert_songs([song])
@@ -114,7 +777,7 @@ class SongRepository:
             stmt = stmt.where(
                 and_(
                     Song.views.is_(None),
-                    func.jsonb_array_length(Song.pvs) > 0
+                    json_array_length(Song.pvs) > 0
                 )
             )
 
@@ -137,7 +800,7 @@ class SongRepository:
             stmt = update(Song)
 
             await session.execute(stmt, updates)
-            await session.commit()
+            await self._commit(session, "update_songs_batch")
 
     def reset_songs_batches(self):
         self._last_id = -1
@@ -154,30 +817,115 @@ class SongRepository:
             return result.scalars().all()
         
     async def insert_song_urls(self, song_urls: List[dict]):
+        """
+        Upserts song URLs by pv_id. Already scraped statistics are kept on conflict.
+        """
+        if (not song_urls):
+            return
+
+        with span("db.insert_song_urls.rows"):
+            rows = _dedupe_by_key(
+                [{column: song_url.get(column) for column in _SONG_URL_PAYLOAD_COLUMNS} for song_url in song_urls],
+                "pv_id"
+            )
+
         async with self.session_factory() as session:
-            song_objects = [SongURL(**song) for song in song_urls]
-            session.add_all(song_objects)
-            await session.commit()
+            await session.execute(self._song_urls_upsert(), rows)
+            await self._commit(session, "insert_song_urls")
 
     async def insert_song_url(self, song_url: dict):
         await self.insert_song_urls([song_url])
 
-    async def _fetch_unprocessed_service_song_URLs_batch(self, service_name: str, batch_size: int = 50) -> List[SongURL]:
+    async def bulk_insert_songs_with_urls(self, songs: List[dict], song_urls: List[dict]):
+        """
+        Bulk alternative to insert_songs + insert_song_urls.
+        Rows are streamed with COPY into temporary staging tables and then upserted
+        with a single INSERT ... SELECT per table, all inside one transaction.
+        SQLite runs executemany upserts inside that transaction instead.
+        """
+        if (not songs and not song_urls):
+            return
+
+        with span("db.bulk_insert.rows"):
+            song_rows = _dedupe_by_key(
+                [{column: song.get(column) for column in _SONG_PAYLOAD_COLUMNS} for song in songs],
+                "id"
+            )
+            song_url_rows = _dedupe_by_key(
+                [{column: song_url.get(column) for column in _SONG_URL_PAYLOAD_COLUMNS} for song_url in song_urls],
+                "pv_id"
+            )
+
         async with self.session_factory() as session:
-            stmt = select(SongURL).order_by(SongURL.id).limit(batch_size)
+            if (self.sqlite):
+                # No COPY on SQLite, the upserts run as executemany batches of the same transaction
+                if (song_rows):
+                    await session.execute(self._songs_upsert(), song_rows)
+                if (song_url_rows):
+                    await session.execute(self._song_urls_upsert(), song_url_rows)
+            else:
+                conn = await session.connection()
+                raw_conn = (await conn.get_raw_connection()).driver_connection
 
-            stmt = stmt.where(
-                and_(
-                    SongURL.service == service_name,
-                    SongURL.views.is_(None)
+                async with raw_conn.cursor() as cur:
+                    # Temporary tables live as long as the pooled connection, rows only until commit
+                    await cur.execute(
+                        "CREATE TEMP TABLE IF NOT EXISTS songs_staging "
+                        "(LIKE songs) ON COMMIT DELETE ROWS"
+                    )
+                    await cur.execute(
+                        "CREATE TEMP TABLE IF NOT EXISTS songurls_staging ("
+                        "pv_id BIGINT, song_id BIGINT, url VARCHAR, service VARCHAR, video_id VARCHAR, published_at TIMESTAMP"
+                        ") ON COMMIT DELETE ROWS"
+                    )
+
+                    if (song_rows):
+                        columns = ", ".join(_quote(column) for column in _SONG_PAYLOAD_COLUMNS)
+                        async with cur.copy(f"COPY songs_staging ({columns}) FROM STDIN") as copy:
+                            for row in song_rows:
+                                await copy.write_row([
+                                    json.dumps(row[column]) if (column in _SONG_JSON_COLUMNS and row[column] is not None) else row[column]
+                                    for column in _SONG_PAYLOAD_COLUMNS
+                                ])
+                        await cur.execute(_upsert_from_staging_sql(
+                            "songs", "songs_staging", _SONG_PAYLOAD_COLUMNS, "id"
+                        ))
+
+                    if (song_url_rows):
+                        columns = ", ".join(_quote(column) for column in _SONG_URL_PAYLOAD_COLUMNS)
+                        async with cur.copy(f"COPY songurls_staging ({columns}) FROM STDIN") as copy:
+                            for row in song_url_rows:
+                                await copy.write_row([row[column] for column in _SONG_URL_PAYLOAD_COLUMNS])
+                        await cur.execute(_upsert_from_staging_sql(
+                            "songurls", "songurls_staging", _SONG_URL_PAYLOAD_COLUMNS, "pv_id"
+                        ))
+
+            await self._sync_catalogue(session, songs)
+            await self._commit(session, "bulk_insert_songs_with_urls")
+
+    async def _fetch_unprocessed_service_song_URLs_batch(self, service_name: str, batch_size: int = 50) -> List[Tuple[int, str]]:
+        """
+        Keyset-paginated over ix_songurls_unprocessed, returns (id, url) rows.
+        Rows that stay unprocessed (e.g. UNKNOWN responses) are not returned again
+        until the service cursor is reset.
+        """
+        async with self.session_factory() as session:
+            stmt = (
+                select(SongURL.id, SongURL.url)
+                .where(
+                    and_(
+                        SongURL.service == service_name,
+                        SongURL.views.is_(None),
+                        SongURL.id > self._last_ids[service_name],
+                        _eligible_for_fetch()
+                    )
                 )
+                .order_by(SongURL.id)
+                .limit(batch_size)
             )
 
-            if (self._last_id is not None):
-                stmt = stmt.where(SongURL.id > 0)
-
             result = await session.execute(stmt)
-            rows: List[SongURL] = result.scalars().all()
+            rows = result.all()
 
             if (rows):
                 self._last_ids[service_name] = rows[-1].id
@@ -189,19 +937,19 @@ class SongRepository:
 
 
 
-    async def fetch_unprocessed_yt_batch(self, batch_size: int = 50) -> List[SongURL]:
+    async def fetch_unprocessed_yt_batch(self, batch_size: int = 50) -> List[Tuple[int, str]]:
         return await self._fetch_unprocessed_service_song_URLs_batch(
             service_names_map[Service.YOUTUBE], 
             batch_size
         )
     
-    async def fetch_unprocessed_nn_batch(self, batch_size: int = 50) -> List[SongURL]:
+    async def fetch_unprocessed_nn_batch(self, batch_size: int = 50) -> List[Tuple[int, str]]:
         return await self._fetch_unprocessed_service_song_URLs_batch(
             service_names_map[Service.NICONICO], 
             batch_size
         )
     
-    async def fetch_unprocessed_bb_batch(self, batch_size: int = 50) -> List[SongURL]:
+    async def fetch_unprocessed_bb_batch(self, batch_size: int = 50) -> List[Tuple[int, str]]:
         return await self._fetch_unprocessed_service_song_URLs_batch(
             service_names_map[Service.BILIBILI], 
             batch_size
@@ -212,10 +960,457 @@ class SongRepository:
             return
 
         async with self.session_factory() as session:
+            written = SongURL.id.in_([upd["id"] for upd in updates])
+            await self._lock_songs(session, Song.id.in_(select(SongURL.song_id).where(written)))
             stmt = update(SongURL)
 
             await session.execute(stmt, updates)
-            await session.commit()
+            await self._insert_stats_snapshots(session, written)
+            await self._update_song_view_totals(session, written)
+            await self._commit(session, "update_song_urls_batch")
+
+    async def _insert_stats_snapshots(self, session: AsyncSession, condition):
+        """
+        Appends the current statistics of the matching song URLs to songurl_stats_history.
+        All snapshots of one transaction share its now() timestamp.
+        """
+        stats_columns = [getattr(SongURL, name) for name in _SONG_URL_STATS_COLUMNS]
+        stmt = insert(SongURLStatsSnapshot).from_select(
+            ["songurl_id", "captured_at", *_SONG_URL_STATS_COLUMNS],
+            select(SongURL.id, db_now(), *stats_columns).where(condition)
+        )
+        await session.execute(stmt)
+
+    async def _lock_songs(self, session: AsyncSession, condition):
+        """
+        Locks the songs matching condition in id order. Pipelines of different services
+        and the merge share songs, so every transaction writing songs takes all of its
+        locks this way before touching them, otherwise two of them can deadlock.
+        """
+        await session.execute(
+            select(Song.id)
+            .where(condition)
+            .order_by(Song.id)
+            .with_for_update()
+        )
+
+    async def _update_song_view_totals(self, session: AsyncSession, condition):
+        """
+        Recomputes totalViews and the per-service totals of songs owning a song URL
+        that matches condition, so they follow every statistics write.
+        The songs must already be locked with _lock_songs.
+        """
+        song_ids = select(SongURL.song_id).where(condition)
+        per_song = (
+            select(
+                SongURL.song_id,
+                func.sum(SongURL.views).label("totalViews"),
+                *(
+                    func.sum(SongURL.views).filter(SongURL.service == service).label(column)
+                    for column, service in _SONG_VIEW_TOTAL_COLUMNS.items()
+                )
+            )
+            .where(SongURL.song_id.in_(song_ids))
+            .group_by(SongURL.song_id)
+            .subquery()
+        )
+        stmt = (
+            update(Song)
+            .where(Song.id == per_song.c.song_id)
+            .values({column: per_song.c[column] for column in ("totalViews", *_SONG_VIEW_TOTAL_COLUMNS)})
+            .execution_options(synchronize_session=False)
+        )
+        await session.execute(stmt)
+
+    async def fetch_unprocessed_video_ids(self, service_name: str, batch_size: int = 50) -> List[str]:
+        """
+        Keyset-paginated over ix_songurls_unprocessed_video_id, returns every
+        distinct video without statistics once, however many songs share it.
+        """
+        async with self.session_factory() as session:
+            stmt = (
+                select(SongURL.video_id)
+                .where(
+                    and_(
+                        SongURL.service == service_name,
+                        SongURL.views.is_(None),
+                        SongURL.video_id > self._last_video_ids[service_name],
+                        _eligible_for_fetch()
+                    )
+                )
+                .group_by(SongURL.video_id)
+                .order_by(SongURL.video_id)
+                .limit(batch_size)
+            )
+
+            result = await session.execute(stmt)
+            video_ids: List[str] = result.scalars().all()
+
+            if (video_ids):
+                self._last_video_ids[service_name] = video_ids[-1]
+
+            return video_ids
+
+    def reset_video_ids_batches(self, service_name: str):
+        self._last_video_ids[service_name] = ""
+
+    async def lease_video_ids(
+        self,
+        service_name: str,
+        worker_id: str,
+        batch_size: int = 50,
+        lease_seconds: int = 600
+    ) -> List[str]:
+        """
+        Claims up to batch_size unprocessed videos of a service for worker_id, so
+        several processes can refresh one database without overlap. Videos leased
+        or being claimed by other workers are skipped, expired leases can be claimed again.
+        Leases end when statistics are written by update_song_urls_by_video_ids
+        or when release_video_ids is called.
+        """
+        return await self._lease(
+            service_name,
+            worker_id,
+            batch_size,
+            lease_seconds,
+            SongURL.views.is_(None),
+            SongURL.video_id,
+            "lease_video_ids"
+        )
+
+    async def lease_due_video_ids(
+        self,
+        service_name: str,
+        worker_id: str,
+        batch_size: int = 50,
+        lease_seconds: int = 600
+    ) -> List[str]:
+        """
+        Like lease_video_ids, but claims videos that already have statistics and
+        whose next_refresh_at has passed, the most overdue first.
+        """
+        return await self._lease(
+            service_name,
+            worker_id,
+            batch_size,
+            lease_seconds,
+            and_(SongURL.views.is_not(None), SongURL.next_refresh_at <= db_now()),
+            SongURL.next_refresh_at,
+            "lease_due_video_ids"
+        )
+
+    async def _lease(
+        self,
+        service_name: str,
+        worker_id: str,
+        batch_size: int,
+        lease_seconds: int,
+        pending,
+        order_by,
+        operation: str
+    ) -> List[str]:
+        claimable = and_(
+            SongURL.service == service_name,
+            pending,
+            SongURL.video_id.is_not(None),
+            (SongURL.leased_until.is_(None)) | (SongURL.leased_until < db_now()),
+            _eligible_for_fetch()
+        )
+        # The limit counts videos, so a video shared by several rows is never split
+        ordered = (
+            select(SongURL.video_id, func.min(order_by).label("position"))
+            .where(claimable)
+            .group_by(SongURL.video_id)
+            .order_by(literal_column("position"))
+            # Keeps PostgreSQL from pushing the lock below into the aggregate,
+            # which would lock every claimable video instead of the first ones
+            .offset(0)
+            .subquery()
+        )
+        candidates = select(ordered.c.video_id)
+        if (not self.sqlite):
+            # FOR UPDATE can't be combined with GROUP BY, videos claimed by other
+            # workers are skipped through a transaction-level lock per video instead.
+            # SQLite writers take turns anyway.
+            candidates = candidates.where(
+                func.pg_try_advisory_xact_lock(func.hashtext(service_name), func.hashtext(ordered.c.video_id))
+            )
+        candidates = candidates.limit(batch_size)
+        # Every row of a claimed video is leased, claimable is checked again
+        # in case another worker got one of them in the meantime
+        stmt = (
+            update(SongURL)
+            .where(and_(claimable, SongURL.video_id.in_(candidates.scalar_subquery())))
+            .values(
+                lease_owner=worker_id,
+                leased_until=seconds_from_now(lease_seconds)
+            )
+            .returning(SongURL.video_id)
+            .execution_options(synchronize_session=False)
+        )
+
+        async with self.session_factory() as session:
+            result = await session.execute(stmt)
+            video_ids = sorted(set(result.scalars().all()))
+            await self._commit(session, operation)
+
+        return video_ids
+
+    async def release_video_ids(self, service_name: str, worker_id: str, video_ids: List[str]):
+        """
+        Gives back leases of worker_id without writing statistics, e.g. after a failed fetch.
+        """
+        if (not video_ids):
+            return
+
+        stmt = (
+            update(SongURL)
+            .where(
+                and_(
+                    SongURL.service == service_name,
+                    SongURL.lease_owner == worker_id,
+                    SongURL.video_id.in_(video_ids)
+                )
+            )
+            .values(lease_owner=None, leased_until=None)
+            .execution_options(synchronize_session=False)
+        )
+
+        async with self.session_factory() as session:
+            await session.execute(stmt)
+            await self._commit(session, "release_video_ids")
+
+    async def update_song_urls_by_video_ids(self, service_name: str, updates: List[dict], chunk_size: int = 1000):
+        """
+        Every update has a video_id and statistics, which are written to all
+        SongURL rows of that video with a single UPDATE ... FROM (VALUES ...) per chunk,
+        or a batched executemany on SQLite.
+        Missing statistics are written as NULL, leases and failure counters of the videos are cleared.
+        """
+        if (not updates):
+            return
+
+        # Snapshots of one transaction share a timestamp, so every video must appear once
+        updates = _dedupe_by_key(updates, "video_id")
+
+        chunks = [updates[i:i + chunk_size] for i in range(0, len(updates), chunk_size)]
+        async with self.session_factory() as session:
+            # All chunks share one transaction, so their songs are locked in id order
+            # up front instead of chunk by chunk
+            song_ids = set()
+            for chunk in chunks:
+                result = await session.execute(
+                    select(SongURL.song_id).distinct().where(_written_videos(service_name, chunk))
+                )
+                song_ids.update(result.scalars().all())
+            song_ids = sorted(song_ids)
+            song_chunks = [song_ids[i:i + chunk_size] for i in range(0, len(song_ids), chunk_size)]
+            for ids in song_chunks:
+                await self._lock_songs(session, Song.id.in_(ids))
+
+            for chunk in chunks:
+                if (self.sqlite):
+                    await self._update_video_stats_executemany(session, service_name, chunk)
+                else:
+                    await self._update_video_stats_from_values(session, service_name, chunk)
+                await self._insert_stats_snapshots(session, _written_videos(service_name, chunk))
+
+            for ids in song_chunks:
+                await self._update_song_view_totals(session, SongURL.song_id.in_(ids))
+
+            await self._commit(session, "update_song_urls_by_video_ids")
+
+    async def _update_video_stats_from_values(self, session: AsyncSession, service_name: str, chunk: List[dict]):
+        stats = values(
+            sa_column("video_id", String),
+            *(sa_column(name, BigInteger) for name in _SONG_URL_STATS_COLUMNS),
+            name="stats"
+        ).data([
+            (upd["video_id"], *(upd.get(name) for name in _SONG_URL_STATS_COLUMNS))
+            for upd in chunk
+        ])
+
+        stmt = (
+            update(SongURL)
+            .where(
+                and_(
+                    SongURL.service == service_name,
+                    SongURL.video_id == stats.c.video_id
+                )
+            )
+            # NULLs inside VALUES are untyped, so they are cast back explicitly
+            .values({
+                **{name: cast(stats.c[name], BigInteger) for name in _SONG_URL_STATS_COLUMNS},
+                **_STATS_WRITE_RESETS,
+                **_refresh_schedule_values(cast(stats.c.views, BigInteger))
+            })
+            .execution_options(synchronize_session=False)
+        )
+        await session.execute(stmt)
+
+    async def _update_video_stats_executemany(self, session: AsyncSession, service_name: str, chunk: List[dict]):
+        new_stats = {name: bindparam(f"new_{name}", type_=BigInteger) for name in _SONG_URL_STATS_COLUMNS}
+        stmt = (
+            update(SongURL)
+            .where(
+                and_(
+                    SongURL.service == service_name,
+                    SongURL.video_id == bindparam("written_video_id")
+                )
+            )
+            .values({
+                **new_stats,
+                **_STATS_WRITE_RESETS,
+                **_refresh_schedule_values(new_stats["views"])
+            })
+        )
+        conn = await session.connection()
+        await conn.execute(stmt, [
+            {
+                "written_video_id": upd["video_id"],
+                **{f"new_{name}": upd.get(name) for name in _SONG_URL_STATS_COLUMNS}
+            }
+            for upd in chunk
+        ])
+
+    async def record_fetch_failures(
+        self,
+        service_name: str,
+        failures: Dict[str, str],
+        max_attempts: int = 5,
+        backoff_seconds: int = 300,
+        max_backoff_seconds: int = 7 * 24 * 3600
+    ):
+        """
+        failures maps video ids to a FailureReason value. Every failure counts an
+        attempt and postpones the next one exponentially (backoff_seconds * 2^attempts,
+        capped at max_backoff_seconds). After max_attempts the rows are dead-lettered
+        and skipped until requeue_dead_letters is called. Leases of the videos are released.
+        """
+        if (not failures):
+            return
+
+        # SET expressions see the row before the update, so attempts are counted from the old value
+        attempts = SongURL.fetch_attempts + 1
+        delay = least(backoff_seconds * func.power(2, SongURL.fetch_attempts), max_backoff_seconds)
+        failure_values = {
+            "fetch_attempts": attempts,
+            "next_attempt_at": seconds_from_now(delay),
+            "dead_lettered_at": case((attempts >= max_attempts, db_now()), else_=None),
+            "lease_owner": None,
+            "leased_until": None
+        }
+
+        async with self.session_factory() as session:
+            if (self.sqlite):
+                # SQLite can't alias VALUES columns, so videos are matched with executemany
+                stmt = (
+                    update(SongURL)
+                    .where(
+                        and_(
+                            SongURL.service == service_name,
+                            SongURL.video_id == bindparam("failed_video_id")
+                        )
+                    )
+                    .values(last_error=bindparam("failed_error"), **failure_values)
+                )
+                conn = await session.connection()
+                await conn.execute(stmt, [
+                    {"failed_video_id": video_id, "failed_error": error}
+                    for video_id, error in failures.items()
+                ])
+            else:
+                errors = values(
+                    sa_column("video_id", String),
+                    sa_column("error", String),
+                    name="errors"
+                ).data(list(failures.items()))
+                stmt = (
+                    update(SongURL)
+                    .where(
+                        and_(
+                            SongURL.service == service_name,
+                            SongURL.video_id == errors.c.video_id
+                        )
+                    )
+                    .values(last_error=errors.c.error, **failure_values)
+                    .execution_options(synchronize_session=False)
+                )
+                await session.execute(stmt)
+            await self._commit(session, "record_fetch_failures")
+
+    async def fetch_dead_letters(self, service_name: Optional[str] = None, limit: int = 1000) -> List[Tuple[str, str, str, int]]:
+        """
+        Returns (service, video_id, last_error, fetch_attempts) of dead-lettered videos.
+        """
+        stmt = (
+            select(SongURL.service, SongURL.video_id, SongURL.last_error, SongURL.fetch_attempts)
+            .where(SongURL.dead_lettered_at.is_not(None))
+            .distinct()
+            .order_by(SongURL.service, SongURL.video_id)
+            .limit(limit)
+        )
+        if (service_name is not None):
+            stmt = stmt.where(SongURL.service == service_name)
+
+        async with self.session_factory() as session:
+            return (await session.execute(stmt)).all()
+
+    async def requeue_dead_letters(self, service_name: Optional[str] = None) -> int:
+        """
+        Gives dead-lettered rows a fresh retry budget. Returns the number of requeued rows.
+        """
+        stmt = (
+            update(SongURL)
+            .where(SongURL.dead_lettered_at.is_not(None))
+            .values(fetch_attempts=0, next_attempt_at=None, dead_lettered_at=None)
+            .execution_options(synchronize_session=False)
+        )
+        if (service_name is not None):
+            stmt = stmt.where(SongURL.service == service_name)
+
+        async with self.session_factory() as session:
+            result = await session.execute(stmt)
+            await self._commit(session, "requeue_dead_letters")
+            return result.rowcount
+
+    async def backfill_video_ids(self, batch_size: int = 10000) -> int:
+        """
+        Fills video_id of rows inserted before the column existed.
+        Returns the number of updated rows.
+        """
+        total = 0
+        last_id = -1
+        while True:
+            async with self.session_factory() as session:
+                rows = (
+                    await session.execute(
+                        select(SongURL.id, SongURL.service, SongURL.url)
+                        .where(
+                            and_(
+                                SongURL.video_id.is_(None),
+                                SongURL.id > last_id
+                            )
+                        )
+                        .order_by(SongURL.id)
+                        .limit(batch_size)
+                    )
+                ).all()
+
+                if (not rows):
+                    break
+
+                updates = [
+                    {"id": row.id, "video_id": canonical_video_id(row.service, row.url)}
+                    for row in rows
+                ]
+                await session.execute(update(SongURL), updates)
+                await self._commit(session, "backfill_video_ids")
+
+                total += len(updates)
+                last_id = rows[-1].id
+
+        return total
 
     def reset_yt_batches(self):
         self._reset_service_song_URLs_batches(
@@ -234,6 +1429,229 @@ class SongRepository:
 
 
 
+    async def fetch_latest_stats(self, songurl_ids: List[int]) -> List[SongURLStatsSnapshot]:
+        """
+        Latest snapshot of every given song URL. PostgreSQL only.
+        """
+        if (not songurl_ids):
+            return []
+
+        async with self.session_factory() as session:
+            stmt = (
+                select(SongURLStatsSnapshot)
+                .where(SongURLStatsSnapshot.songurl_id.in_(songurl_ids))
+                .distinct(SongURLStatsSnapshot.songurl_id)
+                .order_by(SongURLStatsSnapshot.songurl_id, SongURLStatsSnapshot.captured_at.desc())
+            )
+            result = await session.execute(stmt)
+            return result.scalars().all()
+
+    async def fetch_views_deltas(
+        self,
+        days: int,
+        songurl_ids: Optional[List[int]] = None,
+        limit: Optional[int] = None
+    ) -> List[Tuple[int, int, datetime, datetime]]:
+        """
+        Views gained by song URLs over the last days, as
+        (songurl_id, views_delta, first_captured_at, last_captured_at) rows ordered by delta.
+        Only partitions of that time range are scanned. PostgreSQL only.
+        """
+        H = SongURLStatsSnapshot
+        first_views = func.array_agg(aggregate_order_by(H.views, H.captured_at.asc()))[1]
+        last_views = func.array_agg(aggregate_order_by(H.views, H.captured_at.desc()))[1]
+        views_delta = (last_views - first_views).label("views_delta")
+
+        stmt = (
+            select(
+                H.songurl_id,
+                views_delta,
+                func.min(H.captured_at).label("first_captured_at"),
+                func.max(H.captured_at).label("last_captured_at")
+            )
+            .where(
+                and_(
+                    # captured_at comes from the database clock, not the application's
+                    H.captured_at >= seconds_from_now(-days * 86400),
+                    H.views.is_not(None)
+                )
+            )
+            .group_by(H.songurl_id)
+            .order_by(literal_column("views_delta").desc())
+        )
+
+        if (songurl_ids is not None):
+            stmt = stmt.where(H.songurl_id.in_(songurl_ids))
+        if (limit is not None):
+            stmt = stmt.limit(limit)
+
+        async with self.session_factory() as session:
+            result = await session.execute(stmt)
+            return result.all()
+
+
+
+    async def get_max_song_id(self) -> Optional[int]:
+        async with self.session_factory() as session:
+            return (await session.execute(select(func.max(Song.id)))).scalar_one()
+
+    async def get_song_versions(self, song_ids: List[int]) -> Dict[int, Optional[int]]:
+        """
+        Stored VocaDB versions of the given songs, songs that aren't stored are left out.
+        """
+        if (not song_ids):
+            return {}
+        async with self.session_factory() as session:
+            result = await session.execute(select(Song.id, Song.version).where(Song.id.in_(song_ids)))
+            return {song_id: version for song_id, version in result.all()}
+
+    async def get_completed_page_starts(self, page_size: int) -> set[int]:
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(CrawlCheckpoint.page_start)
+                .where(CrawlCheckpoint.page_size == page_size)
+            )
+            return set(result.scalars().all())
+
+    async def mark_page_completed(self, page_start: int, page_size: int, songs_count: int):
+        await self.mark_pages_completed([(page_start, songs_count)], page_size)
+
+    async def mark_pages_completed(self, pages: List[Tuple[int, int]], page_size: int):
+        """
+        Checkpoints (page_start, songs_count) pairs in a single statement.
+        """
+        if (not pages):
+            return
+
+        rows = [
+            {"page_start": page_start, "page_size": page_size, "songs_count": songs_count}
+            for page_start, songs_count in pages
+        ]
+        stmt = self._insert(CrawlCheckpoint)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[CrawlCheckpoint.page_start],
+            set_={
+                "page_size": stmt.excluded.page_size,
+                "songs_count": stmt.excluded.songs_count,
+                "completed_at": db_now()
+            }
+        )
+
+        async with self.session_factory() as session:
+            await session.execute(stmt, rows)
+            await self._commit(session, "mark_pages_completed")
+
+    async def reset_crawl_checkpoints(self):
+        async with self.session_factory() as session:
+            await session.execute(delete(CrawlCheckpoint))
+            await self._commit(session, "reset_crawl_checkpoints")
+
+
+
+    async def merge_views_into_songs(self, chunk_size: int = 10000) -> int:
+        """
+        Computes songs.views from songurls entirely inside the database:
+        {service: [{"url": ..., "views": ...}, ...]} with URLs ordered as in songs.pvs.
+        View totals of the songs are recomputed as well.
+        Songs are updated in id ranges of chunk_size, one transaction per range.
+        Returns the number of updated songs.
+        """
+        async with self.session_factory() as session:
+            min_id, max_id = (
+                await session.execute(select(func.min(Song.id), func.max(Song.id)))
+            ).one()
+
+        if (min_id is None):
+            return 0
+
+        if (self.sqlite):
+            # Rows are aggregated in pvs order, json_group_array has no ORDER BY before SQLite 3.44
+            stmt = text("""
+                UPDATE songs
+                SET views = COALESCE((
+                    SELECT json_group_object(per_service.service, json(per_service.urls))
+                    FROM (
+                        SELECT ordered.service, json_group_array(json_object('url', ordered.url, 'views', ordered.views)) AS urls
+                        FROM (
+                            SELECT su.service, su.url, su.views
+                            FROM json_each(CASE WHEN json_type(songs.pvs) = 'array' THEN songs.pvs ELSE '[]' END) AS pv
+                            JOIN songurls AS su ON su.pv_id = json_extract(pv.value, '$.id')
+                            WHERE su.service IN :services
+                            ORDER BY pv.key
+                        ) AS ordered
+                        GROUP BY ordered.service
+                    ) AS per_service
+                ), '{}')
+                WHERE songs.id >= :lo AND songs.id < :hi
+            """).bindparams(bindparam("services", expanding=True))
+        else:
+            stmt = text("""
+                UPDATE songs AS s
+                SET views = COALESCE(merged.views, '{}'::jsonb)
+                FROM (
+                    SELECT songs.id, agg.views
+                    FROM songs
+                    LEFT JOIN (
+                        SELECT per_service.song_id, jsonb_object_agg(per_service.service, per_service.urls) AS views
+                        FROM (
+                            SELECT
+                                src.id AS song_id,
+                                su.service,
+                                jsonb_agg(
+                                    jsonb_build_object('url', su.url, 'views', su.views)
+                                    ORDER BY pv.ord
+                                ) AS urls
+                            FROM songs AS src
+                            CROSS JOIN LATERAL jsonb_array_elements(
+                                CASE WHEN jsonb_typeof(src.pvs) = 'array' THEN src.pvs ELSE '[]'::jsonb END
+                            ) WITH ORDINALITY AS pv(value, ord)
+                            JOIN songurls AS su ON su.pv_id = (pv.value ->> 'id')::bigint
+                            WHERE src.id >= :lo AND src.id < :hi
+                                AND su.service = ANY(:services)
+                            GROUP BY src.id, su.service
+                        ) AS per_service
+                        GROUP BY per_service.song_id
+                    ) AS agg ON agg.song_id = songs.id
+                    WHERE songs.id >= :lo AND songs.id < :hi
+                ) AS merged
+                WHERE s.id = merged.id
+            """)
+
+        services = list(service_names_map.values())
+        updated = 0
+        for lo in range(min_id, max_id + 1, chunk_size):
+            async with self.session_factory() as session:
+                # The UPDATE alone would lock the songs in whatever order the plan visits them
+                await self._lock_songs(session, and_(Song.id >= lo, Song.id < lo + chunk_size))
+                result = await session.execute(
+                    stmt,
+                    {"lo": lo, "hi": lo + chunk_size, "services": services}
+                )
+                # Also fills the totals of songs refreshed before they were maintained
+                await self._update_song_view_totals(
+                    session,
+                    and_(SongURL.song_id >= lo, SongURL.song_id < lo + chunk_size)
+                )
+                await self._commit(session, "merge_views_into_songs")
+                updated += result.rowcount
+
+        return updated
+
+    async def stream_rows(self, columns: List[Any], chunk_size: int = 10000) -> AsyncGenerator[List[Any], None]:
+        """
+        Streams rows of the given columns (ordered by the first one) through
+        a server-side cursor, chunk_size rows at a time.
+        """
+        stmt = (
+            select(*columns)
+            .order_by(columns[0])
+            .execution_options(yield_per=chunk_size)
+        )
+        async with self.session_factory() as session:
+            result = await session.stream(stmt)
+            async for partition in result.partitions(chunk_size):
+                yield partition
+
     async def fetch_joined_views_in_batches(
         self, batch_size: int = 1000
     ) -> AsyncGenerator[List[Dict[str, Any]], None]:
@@ -263,30 +1681,31 @@ class SongRepository:
                     )
                 ).all()
 
-                # group by song_id and url
-                urls_by_song: Dict[int, Dict[str, Dict[str, Any]]] = {}
-                for su in songurls:
-                    urls_by_song.setdefault(su.song_id, {})[su.url] = {
-                        "views": su.views,
-                        "service": su.service,
-                    }
-
-                batch_result = []
-                for s in songs:
-                    services: Dict[str, List[Dict[str, Any]]] = {}
-
-                    for pv_url in (s.pvs or []):  # preserve pvs order
-                        url_info = urls_by_song.get(s.id, {}).get(pv_url["url"])
-                        if url_info:
-                            services.setdefault(url_info["service"], []).append({
-                                "url": pv_url["url"],
-                                "views": url_info["views"]
-                            })
-
-                    batch_result.append({
-                        "song_id": s.id,
-                        "services": services
-                    })
+                with span("db.joined_views.reshape"):
+                    # group by song_id and url
+                    urls_by_song: Dict[int, Dict[str, Dict[str, Any]]] = {}
+                    for su in songurls:
+                        urls_by_song.setdefault(su.song_id, {})[su.url] = {
+                            "views": su.views,
+                            "service": su.service,
+                        }
+
+                    batch_result = []
+                    for s in songs:
+                        services: Dict[str, List[Dict[str, Any]]] = {}
+
+                        for pv_url in (s.pvs or []):  # preserve pvs order
+                            url_info = urls_by_song.get(s.id, {}).get(pv_url["url"])
+                            if url_info:
+                                services.setdefault(url_info["service"], []).append({
+                                    "url": pv_url["url"],
+                                    "views": url_info["views"]
+                                })
+
+                        batch_result.append({
+                            "song_id": s.id,
+                            "services": services
+                        })
 
                 yield batch_result
 
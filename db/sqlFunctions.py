@@ -0,0 +1,132 @@
+"""
+SQL functions whose spelling differs between PostgreSQL and SQLite.
+PostgreSQL is the default rendering, SQLite timestamps are UTC text
+with millisecond precision, comparable with the DateTime columns.
+"""
+from sqlalchemy import DateTime, Float, Integer
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+_SQLITE_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now'"
+
+
+class db_now(FunctionElement):
+    """
+    Current transaction timestamp.
+    """
+    type = DateTime()
+    name = "db_now"
+    inherit_cache = True
+
+
+@compiles(db_now)
+def _db_now(element, compiler, **kw):
+    return "now()"
+
+
+@compiles(db_now, "sqlite")
+def _db_now_sqlite(element, compiler, **kw):
+    return f"{_SQLITE_NOW})"
+
+
+class seconds_from_now(FunctionElement):
+    """
+    Timestamp a given number of seconds after db_now().
+    """
+    type = DateTime()
+    name = "seconds_from_now"
+    inherit_cache = True
+
+
+@compiles(seconds_from_now)
+def _seconds_from_now(element, compiler, **kw):
+    return f"now() + ({compiler.process(element.clauses, **kw)}) * interval '1 second'"
+
+
+@compiles(seconds_from_now, "sqlite")
+def _seconds_from_now_sqlite(element, compiler, **kw):
+    return f"{_SQLITE_NOW}, printf('%+.3f seconds', {compiler.process(element.clauses, **kw)}))"
+
+
+class days_since(FunctionElement):
+    """
+    Fractional days between a timestamp and db_now().
+    """
+    type = Float()
+    name = "days_since"
+    inherit_cache = True
+
+
+@compiles(days_since)
+def _days_since(element, compiler, **kw):
+    return f"extract(epoch from now() - ({compiler.process(element.clauses, **kw)})) / 86400.0"
+
+
+@compiles(days_since, "sqlite")
+def _days_since_sqlite(element, compiler, **kw):
+    return f"(julianday('now') - julianday({compiler.process(element.clauses, **kw)}))"
+
+
+class greatest(FunctionElement):
+    name = "greatest"
+    inherit_cache = True
+
+
+@compiles(greatest)
+def _greatest(element, compiler, **kw):
+    return f"greatest({compiler.process(element.clauses, **kw)})"
+
+
+@compiles(greatest, "sqlite")
+def _greatest_sqlite(element, compiler, **kw):
+    return f"max({compiler.process(element.clauses, **kw)})"
+
+
+class least(FunctionElement):
+    name = "least"
+    inherit_cache = True
+
+
+@compiles(least)
+def _least(element, compiler, **kw):
+    return f"least({compiler.process(element.clauses, **kw)})"
+
+
+@compiles(least, "sqlite")
+def _least_sqlite(element, compiler, **kw):
+    return f"min({compiler.process(element.clauses, **kw)})"
+
+
+class json_array_length(FunctionElement):
+    type = Integer()
+    name = "json_array_length"
+    inherit_cache = True
+
+
+@compiles(json_array_length)
+def _json_array_length(element, compiler, **kw):
+    return f"jsonb_array_length({compiler.process(element.clauses, **kw)})"
+
+
+@compiles(json_array_length, "sqlite")
+def _json_array_length_sqlite(element, compiler, **kw):
+    return f"json_array_length({compiler.process(element.clauses, **kw)})"
+
+
+class desc_nulls_last(FunctionElement):
+    """
+    Descending index column with NULLs at the end. SQLite rejects NULLS LAST
+    inside CREATE INDEX, but sorts NULLs first, so DESC already puts them last.
+    """
+    name = "desc_nulls_last"
+    inherit_cache = True
+
+
+@compiles(desc_nulls_last)
+def _desc_nulls_last(element, compiler, **kw):
+    return f"{compiler.process(element.clauses, **kw)} DESC NULLS LAST"
+
+
+@compiles(desc_nulls_last, "sqlite")
+def _desc_nulls_last_sqlite(element, compiler, **kw):
+    return f"{compiler.process(element.clauses, **kw)} DESC"
@@ -0,0 +1,124 @@
+"""
+Write-behind buffer for fetched video statistics. Producers hand over results
+and carry on, a background task writes everything collected so far with one
+UPDATE ... FROM (VALUES ...) once max_rows are pending or flush_interval has passed.
+"""
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from db.db import SongRepository
+
+from utils.metrics import queue_depth
+from utils.profiling import span
+
+
+class UpdateBuffer:
+    def __init__(
+        self,
+        db: SongRepository,
+        service_name: str,
+        max_attempts: int = 5,
+        backoff_seconds: int = 300,
+        max_rows: int = 1000,
+        flush_interval: float = 2.0,
+        max_pending_rows: Optional[int] = None
+    ):
+        """
+        Used as an async context manager, leaving it flushes what is left.
+        add() blocks while max_pending_rows (2 * max_rows by default) are waiting,
+        so producers slow down to the pace of the database instead of piling up memory.
+        max_attempts and backoff_seconds are passed to SongRepository.record_fetch_failures.
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.setLevel(logging.DEBUG)
+
+        self.db = db
+        self.service_name = service_name
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self.max_pending_rows = max_pending_rows or 2 * max_rows
+
+        self._updates: List[dict] = []
+        self._failures: Dict[str, str] = {}
+        self._wakeup = asyncio.Event()
+        self._flushed = asyncio.Condition()
+        self._closing = False
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending_rows(self) -> int:
+        return len(self._updates) + len(self._failures)
+
+    async def __aenter__(self) -> "UpdateBuffer":
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def add(self, updates: List[dict], failures: Dict[str, str]):
+        """
+        Same arguments as SongRepository.update_song_urls_by_video_ids and
+        record_fetch_failures. Raises the error of a failed flush.
+        """
+        async with self._flushed:
+            while (self.pending_rows >= self.max_pending_rows and not self._task.done()):
+                await self._flushed.wait()
+        if (self._task.done()):
+            # Raises the flush error, or reports use after close
+            self._task.result()
+            raise RuntimeError("UpdateBuffer is closed")
+
+        self._updates.extend(updates)
+        self._failures.update(failures)
+        queue_depth.set(self.pending_rows, pipeline=self.service_name, queue="write_buffer")
+        if (self.pending_rows >= self.max_rows):
+            self._wakeup.set()
+
+    async def flush(self):
+        updates, self._updates = self._updates, []
+        failures, self._failures = self._failures, {}
+        # A video fetched successfully within the same window isn't failing anymore
+        updated = {update["video_id"] for update in updates}
+        failures = {video_id: error for video_id, error in failures.items() if (video_id not in updated)}
+        queue_depth.set(self.pending_rows, pipeline=self.service_name, queue="write_buffer")
+        try:
+            with span(f"{self.service_name}.write"):
+                if (updates):
+                    await self.db.update_song_urls_by_video_ids(self.service_name, updates)
+                if (failures):
+                    await self.db.record_fetch_failures(
+                        self.service_name,
+                        failures,
+                        self.max_attempts,
+                        self.backoff_seconds
+                    )
+        finally:
+            async with self._flushed:
+                self._flushed.notify_all()
+        if (updates or failures):
+            self.logger.debug(f"Flushed {len(updates)} {self.service_name} videos ({len(failures)} failed)")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            # Rows added while this flush runs get one more round after close()
+            closing = self._closing
+            await self.flush()
+            if (closing):
+                break
+
+    async def close(self):
+        """
+        Writes whatever is still pending and stops the background task.
+        """
+        self._closing = True
+        self._wakeup.set()
+        await self._task
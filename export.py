@@ -0,0 +1,42 @@
+import argparse
+import asyncio
+import dotenv
+import logging
+import os
+import sys
+
+from db.db import SongRepository
+
+from pipelines.datasetExport import export_songs, export_song_urls
+
+dotenv.load_dotenv()
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Export songs (and optionally songurls) table as a dataset. "
+                    "The format is picked by extension: .parquet (requires pyarrow) or .csv.gz"
+    )
+    parser.add_argument("songs_path", help="Output file of songs table")
+    parser.add_argument("--urls-path", help="Output file of songurls table, skipped if not set")
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=10000,
+        help="Rows fetched from the server-side cursor at once (and Parquet row group size)"
+    )
+    return parser.parse_args()
+
+async def main(args: argparse.Namespace):
+    async with SongRepository(os.environ["DB_URL"]) as db:
+        exported = await export_songs(db, args.songs_path, args.chunk_size)
+        logging.info(f"Exported {exported} songs into {args.songs_path}")
+
+        if (args.urls_path):
+            exported = await export_song_urls(db, args.urls_path, args.chunk_size)
+            logging.info(f"Exported {exported} song URLs into {args.urls_path}")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s: %(message)s")
+    if sys.platform.startswith("win"):
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    asyncio.run(main(parse_args()))
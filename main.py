@@ -1,3 +1,4 @@
+import argparse
 import asyncio
 import dotenv
 import os
@@ -6,6 +7,11 @@ from tqdm import tqdm
 
 from scrapers.vocaDBScraper import VocaDBScraper
 
+from utils.httpClient import HttpClient
+from utils.httpCache import ResponseCache
+from utils.metrics import add_metrics_arguments, metrics_reporting
+from utils.profiling import add_profile_arguments, profile_reporting, span
+
 dotenv.load_dotenv()
 
 acceptable_services = [
@@ -14,17 +20,76 @@ acceptable_services = [
     "Bilibili"
 ]
     
-async def main():
+def parse_args():
+    parser = argparse.ArgumentParser(description="Scrape songs from VocaDB API into the database.")
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Ignore crawl checkpoints and fetch every page again"
+    )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Only fetch songs added or edited on VocaDB since the catalogue was crawled"
+    )
+    parser.add_argument(
+        "--skip-edits",
+        action="store_true",
+        help="With --sync, only fetch new songs and don't compare versions of the stored ones"
+    )
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="Write pages with PostgreSQL COPY instead of ORM inserts (one transaction per batch on SQLite)"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="Keep API responses in this directory, so re-runs are served from disk"
+    )
+    parser.add_argument(
+        "--gin-indexes",
+        action="store_true",
+        help="Build GIN indexes on songs.artists and songs.tags"
+    )
+    parser.add_argument(
+        "--rebuild-catalogue",
+        action="store_true",
+        help="Only rebuild artists, tags, song_artists and song_tags from the stored songs"
+    )
+    add_metrics_arguments(parser)
+    add_profile_arguments(parser)
+    return parser.parse_args()
+    
+async def main(args: argparse.Namespace):
     """
     This function will only scrape data from VocaDB API, it won't restore views for it.
     For restoring views use views.ipynb 
     """
-    scraper = VocaDBScraper(os.environ["DB_URL"])
+    async with metrics_reporting(args), profile_reporting(args), HttpClient() as client:
+        cache = ResponseCache(args.cache_dir) if (args.cache_dir) else None
+        scraper = VocaDBScraper(os.environ["DB_URL"], bulk_insert=args.bulk, client=client, cache=cache)
+
+        async with scraper.db:
+            if (args.gin_indexes or args.rebuild_catalogue):
+                await scraper.db.init_models()
+            if (args.gin_indexes):
+                with span("gin_indexes"):
+                    await scraper.db.ensure_jsonb_gin_indexes()
+            if (args.rebuild_catalogue):
+                with span("rebuild_catalogue"):
+                    await scraper.db.rebuild_catalogue()
+                return
+
+            if (args.sync):
+                with tqdm(desc="Syncing changes from VocaDB") as pbar, span("sync"):
+                    await scraper.sync(pbar=pbar, check_edits=not args.skip_edits)
+                return
 
-    with tqdm(desc="Fetching data from VocaDB") as pbar:
-        await scraper.run(pbar=pbar)
+            with tqdm(desc="Fetching data from VocaDB") as pbar, span("crawl"):
+                await scraper.run(pbar=pbar, resume=not args.restart)
 
 if __name__ == "__main__":
     if sys.platform.startswith("win"):
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main(parse_args()))
\ No newline at end of file
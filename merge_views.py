@@ -0,0 +1,41 @@
+import argparse
+import asyncio
+import dotenv
+import logging
+import os
+import sys
+
+from db.db import SongRepository
+
+from utils.profiling import add_profile_arguments, profile_reporting, span
+
+dotenv.load_dotenv()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Merge views from songurls table into songs table.")
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=10000,
+        help="Range of song ids updated inside one transaction"
+    )
+    add_profile_arguments(parser)
+    return parser.parse_args()
+
+async def main(args: argparse.Namespace):
+    """
+    The merge runs entirely inside the database, no rows pass through Python.
+    """
+    async with SongRepository(os.environ["DB_URL"]) as db:
+        await db.init_models()
+
+        async with profile_reporting(args):
+            with span("merge_views"):
+                updated = await db.merge_views_into_songs(args.chunk_size)
+        logging.info(f"Updated views of {updated} songs")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s: %(message)s")
+    if sys.platform.startswith("win"):
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,160 @@
+"""
+Streaming export of songs and songurls tables into Parquet row groups or gzip CSV.
+Rows are read through a server-side cursor chunk by chunk, so memory use stays
+flat however large the catalogue is. JSONB columns are serialised as JSON strings.
+"""
+import csv
+import gzip
+import json
+import logging
+from datetime import datetime
+from typing import Any, List, Tuple
+
+from db.db import SongRepository, Song, SongURL
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# (column name, type) of the published dataset, the order is fixed
+song_export_schema: List[Tuple[str, str]] = [
+    ("id", "int"),
+    ("originalVersionId", "int"),
+    ("name", "str"),
+    ("defaultName", "str"),
+    ("defaultNameLanguage", "str"),
+    ("artistString", "str"),
+    ("lengthSeconds", "int"),
+    ("pvServices", "str"),
+    ("minMilliBpm", "int"),
+    ("maxMilliBpm", "int"),
+    ("songType", "str"),
+    ("favoritedTimes", "int"),
+    ("ratingScore", "int"),
+    ("createDate", "datetime"),
+    ("publishDate", "datetime"),
+    ("status", "str"),
+    ("version", "int"),
+    ("additionalNames", "json"),
+    ("pvs", "json"),
+    ("views", "json"),
+    ("artists", "json"),
+    ("tags", "json"),
+]
+
+song_url_export_schema: List[Tuple[str, str]] = [
+    ("id", "int"),
+    ("pv_id", "int"),
+    ("song_id", "int"),
+    ("url", "str"),
+    ("service", "str"),
+    ("video_id", "str"),
+    ("views", "int"),
+    ("likes", "int"),
+    ("dislikes", "int"),
+    ("favorites", "int"),
+    ("published_at", "datetime"),
+    ("updated_at", "datetime"),
+]
+
+
+def _serialise(value: Any, kind: str) -> Any:
+    if (value is None):
+        return None
+    if (kind == "json"):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def _arrow_schema(schema: List[Tuple[str, str]]):
+    types = {
+        "int": pa.int64(),
+        "str": pa.string(),
+        "json": pa.string(),
+        "datetime": pa.timestamp("us"),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in schema])
+
+
+class ParquetTableWriter:
+    """
+    Every written chunk becomes one row group.
+    """
+    def __init__(self, path: str, schema: List[Tuple[str, str]]):
+        if (pa is None):
+            raise RuntimeError("Parquet export requires pyarrow, install it or export to .csv.gz")
+        self.schema = schema
+        self.arrow_schema = _arrow_schema(schema)
+        self.writer = pq.ParquetWriter(path, self.arrow_schema, compression="zstd")
+
+    def write(self, rows: List[Any]):
+        columns = [
+            [_serialise(row[i], kind) for row in rows]
+            for i, (_, kind) in enumerate(self.schema)
+        ]
+        self.writer.write_table(pa.Table.from_arrays(columns, schema=self.arrow_schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class CSVGzipTableWriter:
+    def __init__(self, path: str, schema: List[Tuple[str, str]]):
+        self.schema = schema
+        self.file = gzip.open(path, "wt", encoding="utf-8", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([name for name, _ in schema])
+
+    def write(self, rows: List[Any]):
+        self.writer.writerows(
+            [
+                "" if (value is None) else (value.isoformat() if isinstance(value, datetime) else value)
+                for value in (_serialise(row[i], kind) for i, (_, kind) in enumerate(self.schema))
+            ]
+            for row in rows
+        )
+
+    def close(self):
+        self.file.close()
+
+
+def open_table_writer(path: str, schema: List[Tuple[str, str]]):
+    if (path.endswith(".parquet")):
+        return ParquetTableWriter(path, schema)
+    elif (path.endswith(".csv.gz")):
+        return CSVGzipTableWriter(path, schema)
+    raise ValueError(f"Unsupported export format of {path}, use .parquet or .csv.gz")
+
+
+async def export_table(
+    db: SongRepository,
+    model: type,
+    schema: List[Tuple[str, str]],
+    path: str,
+    chunk_size: int = 10000
+) -> int:
+    """
+    Returns the number of exported rows.
+    """
+    writer = open_table_writer(path, schema)
+    columns = [getattr(model, name) for name, _ in schema]
+    exported = 0
+    try:
+        async for rows in db.stream_rows(columns, chunk_size):
+            writer.write(rows)
+            exported += len(rows)
+            logging.debug(f"Exported {exported} rows into {path}")
+    finally:
+        writer.close()
+    return exported
+
+
+async def export_songs(db: SongRepository, path: str, chunk_size: int = 10000) -> int:
+    return await export_table(db, Song, song_export_schema, path, chunk_size)
+
+
+async def export_song_urls(db: SongRepository, path: str, chunk_size: int = 10000) -> int:
+    return await export_table(db, SongURL, song_url_export_schema, path, chunk_size)
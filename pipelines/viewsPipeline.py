@@ -0,0 +1,326 @@
+"""
+Producer/consumer pipelines that restore views for SongURL rows.
+Each service runs its own chain: DB reader -> scraper -> DB writer,
+linked by bounded queues so network I/O and DB writes overlap.
+Videos are requested once per (service, video_id) and the result is
+written to every SongURL row of that video.
+"""
+import asyncio
+import logging
+import os
+import socket
+from typing import Dict, List, Tuple, Optional
+
+from db.db import SongRepository
+from db.updateBuffer import UpdateBuffer
+
+from constants.states import ResponseState, FailureReason
+from constants.services import Service, service_names_map
+
+from scrapers.youtubeVideoStatistics import YouTubeScraper
+from scrapers.niconicoVideoStatistics import NicoNicoScraper
+from scrapers.bilibiliVideoStatistics import BilibiliScraper
+
+from utils.httpClient import classify_exception
+from utils.quotaManager import QuotaExhaustedError
+from utils.metrics import queue_depth
+from utils.profiling import span
+
+
+def yt_results_to_updates(video_ids: List[str], res: List[dict]) -> Tuple[bool, List[dict]]:
+    updates = []
+    present_ids = set()
+    for item in res:
+        stats = item.get('statistics', {})
+        present_ids.add(item["id"])
+        updates.append({
+            'video_id' : item["id"],
+            'views' : stats.get('viewCount', 0),
+            'likes' : stats.get('likeCount', None),
+            'dislikes' : stats.get('dislikeCount', None),
+            'favorites' : stats.get('favoriteCount', None)
+        })
+
+    # Videos missing from the response are deleted or private
+    for video_id in video_ids:
+        if (video_id not in present_ids):
+            updates.append({
+                'video_id' : video_id,
+                'views' : 0,
+                'likes' : 0,
+                'dislikes' : 0,
+                'favorites' : 0
+            })
+    return (True, updates)
+
+
+def nn_results_to_updates(video_ids: List[str], res: List[Tuple[str, ResponseState, dict]]) -> Tuple[bool, List[dict]]:
+    everything_ok = True
+    updates = []
+    for item in res:
+        if (item[1] == ResponseState.UNKNOWN):
+            everything_ok = False
+            continue
+
+        updates.append({
+            'video_id' : item[0],
+            'views' : item[2].get('views', 0)
+        })
+    
+    return (everything_ok, updates)
+
+
+def bb_results_to_updates(video_ids: List[str], res: List[Tuple[str, ResponseState, dict]]) -> Tuple[bool, List[dict]]:
+    everything_ok = True
+    updates = []
+    for item in res:
+        if (item[1] == ResponseState.UNKNOWN):
+            everything_ok = False
+            continue
+
+        updates.append({
+            'video_id' : item[0],
+            'views' : item[2].get('views', 0),
+            'likes' : item[2].get('likes', 0),
+            'dislikes' : item[2].get('dislikes', 0),
+            'favorites' : item[2].get('favorites', 0)
+        })
+    
+    return (everything_ok, updates)
+
+
+def unknown_results_to_failures(res: List[Tuple[str, ResponseState, dict]]) -> Dict[str, str]:
+    return {
+        item[0]: item[2].get('error', FailureReason.UNEXPECTED).value
+        for item in res
+        if (item[1] == ResponseState.UNKNOWN)
+    }
+
+
+class ServicePipeline:
+    """
+    Base pipeline, subclasses define how batches are read, fetched and converted.
+    """
+    service = Service.UNKNOWN
+    # Videos covered by a single API request, budgets are counted in requests
+    videos_per_request = 1
+
+    def __init__(
+        self,
+        db: SongRepository,
+        batch_size: int,
+        queue_size: int = 2,
+        worker_id: Optional[str] = None,
+        lease_seconds: int = 600,
+        max_attempts: int = 5,
+        backoff_seconds: int = 300,
+        refresh: bool = False,
+        budget: Optional[int] = None,
+        flush_rows: int = 1000,
+        flush_interval: float = 2.0
+    ):
+        """
+        With worker_id batches are leased from the database instead of read with
+        the repository's keyset cursor, so several workers can share one service.
+        Failed videos back off exponentially from backoff_seconds and are
+        dead-lettered after max_attempts, see SongRepository.record_fetch_failures.
+        refresh re-fetches videos whose next_refresh_at has passed instead of
+        unprocessed ones, it always leases. budget caps the API requests of a run.
+        Results are written behind by an UpdateBuffer, every flush_rows videos or
+        flush_interval seconds, so small batches don't wait for their own commit.
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.setLevel(logging.DEBUG)
+
+        self.db = db
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.refresh = refresh
+        self.budget = budget
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+
+        # Set once the API quota ran out, the rest of the run is skipped
+        self._stopping = False
+
+        if (self.refresh and self.worker_id is None):
+            self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+
+    @property
+    def service_name(self) -> str:
+        return service_names_map[self.service]
+
+    async def fetch_batch(self, batch_size: int) -> List[str]:
+        if (self.refresh):
+            return await self.db.lease_due_video_ids(self.service_name, self.worker_id, batch_size, self.lease_seconds)
+        if (self.worker_id is not None):
+            return await self.db.lease_video_ids(self.service_name, self.worker_id, batch_size, self.lease_seconds)
+        return await self.db.fetch_unprocessed_video_ids(self.service_name, batch_size)
+
+    async def fetch_stats(self, ids: List[str]) -> list:
+        raise NotImplementedError
+
+    def to_updates(self, video_ids: List[str], res: list) -> Tuple[bool, List[dict]]:
+        raise NotImplementedError
+
+    def to_failures(self, video_ids: List[str], res: list) -> Dict[str, str]:
+        """
+        Maps videos that couldn't be fetched to a FailureReason value.
+        """
+        return {}
+
+    async def _read(self, batches: asyncio.Queue):
+        remaining = None if (self.budget is None) else self.budget * self.videos_per_request
+        while (not self._stopping and (remaining is None or remaining > 0)):
+            batch_size = self.batch_size if (remaining is None) else min(self.batch_size, remaining)
+            batch = await self.fetch_batch(batch_size)
+            if (len(batch) == 0):
+                break
+            if (remaining is not None):
+                remaining -= len(batch)
+            await batches.put(batch)
+            queue_depth.set(batches.qsize(), pipeline=self.service_name, queue="batches")
+        await batches.put(None)
+
+    async def _release(self, batch: List[str]):
+        if (self.worker_id is not None):
+            await self.db.release_video_ids(self.service_name, self.worker_id, batch)
+
+    async def _fetch(self, batches: asyncio.Queue, updates_queue: asyncio.Queue):
+        while True:
+            batch = await batches.get()
+            queue_depth.set(batches.qsize(), pipeline=self.service_name, queue="batches")
+            if (batch is None):
+                break
+            if (self._stopping):
+                await self._release(batch)
+                continue
+
+            try:
+                with span(f"{self.service_name}.fetch"):
+                    res = await self.fetch_stats(batch)
+            except QuotaExhaustedError as e:
+                # Not the videos' fault, so it isn't counted against their retry budget
+                self.logger.warning(f"Stopping: {e}")
+                self._stopping = True
+                await self._release(batch)
+                continue
+            except Exception as e:
+                self.logger.error(f"Fetching batch starting at video {batch[0]} failed: {e}")
+                reason = classify_exception(e).value
+                await updates_queue.put(([], {video_id: reason for video_id in batch}))
+                continue
+
+            with span(f"{self.service_name}.convert"):
+                state, updates = self.to_updates(batch, res)
+                failures = self.to_failures(batch, res)
+            await updates_queue.put((updates, failures))
+            queue_depth.set(updates_queue.qsize(), pipeline=self.service_name, queue="updates")
+
+            # Pacing is up to the scraper's rate limiter, failed videos stay unprocessed
+            if (not state):
+                self.logger.info(f"Some requests of batch starting at video {batch[0]} failed")
+        await updates_queue.put(None)
+
+    async def _write(self, updates_queue: asyncio.Queue):
+        cnt = 0
+        buffer = UpdateBuffer(
+            self.db,
+            self.service_name,
+            self.max_attempts,
+            self.backoff_seconds,
+            self.flush_rows,
+            self.flush_interval
+        )
+        async with buffer:
+            while True:
+                item = await updates_queue.get()
+                queue_depth.set(updates_queue.qsize(), pipeline=self.service_name, queue="updates")
+                if (item is None):
+                    break
+                updates, failures = item
+                await buffer.add(updates, failures)
+                cnt += 1
+                self.logger.info(f"Finished batch {cnt} ({len(updates)} videos, {len(failures)} failed)")
+
+    async def run(self):
+        self._stopping = False
+        if (self.worker_id is None):
+            self.db.reset_video_ids_batches(self.service_name)
+        batches = asyncio.Queue(maxsize=self.queue_size)
+        updates_queue = asyncio.Queue(maxsize=self.queue_size)
+
+        tasks = [
+            asyncio.create_task(self._read(batches)),
+            asyncio.create_task(self._fetch(batches, updates_queue)),
+            asyncio.create_task(self._write(updates_queue))
+        ]
+        try:
+            with span(f"{self.service_name}.refresh"):
+                await asyncio.gather(*tasks)
+        except BaseException:
+            # A failed stage never drains or fills its queues, the others would wait forever
+            for task in tasks:
+                task.cancel()
+            raise
+        self.logger.info("Finished!")
+
+
+class YouTubePipeline(ServicePipeline):
+    service = Service.YOUTUBE
+    videos_per_request = 50
+
+    def __init__(self, db: SongRepository, scraper: YouTubeScraper, batch_size: int = 500, **kwargs):
+        super().__init__(db, batch_size, **kwargs)
+        self.scraper = scraper
+
+    async def fetch_stats(self, ids: List[str]) -> tuple:
+        return await self.scraper.fetch_videos_stats(ids)
+
+    def to_updates(self, video_ids: List[str], res: tuple) -> Tuple[bool, List[dict]]:
+        items, failures = res
+        # Videos of failed chunks are missing from items, but they aren't deleted
+        fetched_ids = [video_id for video_id in video_ids if (video_id not in failures)]
+        state, updates = yt_results_to_updates(fetched_ids, items)
+        return (state and not failures, updates)
+
+    def to_failures(self, video_ids: List[str], res: tuple) -> Dict[str, str]:
+        return res[1]
+
+
+class NicoNicoPipeline(ServicePipeline):
+    service = Service.NICONICO
+
+    def __init__(self, db: SongRepository, scraper: Optional[NicoNicoScraper] = None, batch_size: int = 500, **kwargs):
+        super().__init__(db, batch_size, **kwargs)
+        self.scraper = scraper or NicoNicoScraper()
+
+    async def fetch_stats(self, ids: List[str]) -> list:
+        return await self.scraper.get_videos_data(ids)
+
+    def to_updates(self, video_ids: List[str], res: list) -> Tuple[bool, List[dict]]:
+        return nn_results_to_updates(video_ids, res)
+
+    def to_failures(self, video_ids: List[str], res: list) -> Dict[str, str]:
+        return unknown_results_to_failures(res)
+
+
+class BilibiliPipeline(ServicePipeline):
+    service = Service.BILIBILI
+
+    def __init__(self, db: SongRepository, scraper: Optional[BilibiliScraper] = None, batch_size: int = 50, **kwargs):
+        super().__init__(db, batch_size, **kwargs)
+        self.scraper = scraper or BilibiliScraper()
+
+    async def fetch_stats(self, ids: List[str]) -> list:
+        return await self.scraper.get_videos_data(ids)
+
+    def to_updates(self, video_ids: List[str], res: list) -> Tuple[bool, List[dict]]:
+        return bb_results_to_updates(video_ids, res)
+
+    def to_failures(self, video_ids: List[str], res: list) -> Dict[str, str]:
+        return unknown_results_to_failures(res)
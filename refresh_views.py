@@ -0,0 +1,158 @@
+import argparse
+import asyncio
+import dotenv
+import logging
+import os
+import sys
+from typing import Dict, List, Optional
+
+from db.db import SongRepository
+
+from scrapers.youtubeVideoStatistics import YouTubeScraper
+from scrapers.niconicoVideoStatistics import NicoNicoScraper
+from scrapers.bilibiliVideoStatistics import BilibiliScraper
+
+from utils.httpClient import HttpClient
+from utils.httpCache import ResponseCache
+from utils.metrics import add_metrics_arguments, metrics_reporting
+from utils.profiling import add_profile_arguments, profile_reporting
+
+from pipelines.viewsPipeline import (
+    ServicePipeline,
+    YouTubePipeline,
+    NicoNicoPipeline,
+    BilibiliPipeline
+)
+
+dotenv.load_dotenv()
+
+acceptable_services = [
+    "youtube",
+    "niconico",
+    "bilibili"
+]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Restore views for every URL inside songurls table.")
+    parser.add_argument(
+        "--services",
+        nargs="+",
+        choices=acceptable_services,
+        default=acceptable_services,
+        help="Services to refresh, all of them run concurrently"
+    )
+    parser.add_argument("--yt-batch-size", type=int, default=500)
+    parser.add_argument("--nn-batch-size", type=int, default=500)
+    parser.add_argument("--bb-batch-size", type=int, default=50)
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Re-fetch videos that are due for a refresh instead of unprocessed ones"
+    )
+    parser.add_argument("--yt-budget", type=int, default=None, help="Max YouTube API requests per run")
+    parser.add_argument("--nn-budget", type=int, default=None, help="Max NicoNico API requests per run")
+    parser.add_argument("--bb-budget", type=int, default=None, help="Max Bilibili API requests per run")
+    parser.add_argument(
+        "--worker-id",
+        default=None,
+        help="Lease batches from the database under this id, so several workers can run at once"
+    )
+    parser.add_argument("--lease-seconds", type=int, default=600)
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=5,
+        help="Failed fetches of a video before it's dead-lettered"
+    )
+    parser.add_argument(
+        "--requeue-dead-letters",
+        action="store_true",
+        help="Give dead-lettered videos of the selected services another retry budget"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="Keep API responses in this directory, so re-runs are served from disk"
+    )
+    add_metrics_arguments(parser)
+    add_profile_arguments(parser)
+    return parser.parse_args()
+
+def build_pipelines(
+    db: SongRepository,
+    services: List[str],
+    youtube_api_keys: Optional[List[str]] = None,
+    yt_batch_size: int = 500,
+    nn_batch_size: int = 500,
+    bb_batch_size: int = 50,
+    client: Optional[HttpClient] = None,
+    cache: Optional[ResponseCache] = None,
+    worker_id: Optional[str] = None,
+    lease_seconds: int = 600,
+    max_attempts: int = 5,
+    refresh: bool = False,
+    budgets: Optional[Dict[str, int]] = None
+) -> List[ServicePipeline]:
+    """
+    client is shared by every scraper, so connections are reused across batches.
+    worker_id switches the pipelines to database leases, see ServicePipeline.
+    With refresh, due videos are re-fetched within budgets, keyed like services.
+    cache only applies to NicoNico and Bilibili, YouTube chunks carry the API key
+    and differ between runs.
+    """
+    options = {"worker_id": worker_id, "lease_seconds": lease_seconds, "max_attempts": max_attempts, "refresh": refresh}
+    budgets = budgets or {}
+    pipelines = []
+    if ("youtube" in services):
+        if (youtube_api_keys):
+            scraper = YouTubeScraper(api_keys=youtube_api_keys, client=client)
+            pipelines.append(YouTubePipeline(db, scraper, yt_batch_size, budget=budgets.get("youtube"), **options))
+        else:
+            logging.warning("No YouTube API keys were provided, skipping YouTube.")
+    if ("niconico" in services):
+        pipelines.append(NicoNicoPipeline(db, NicoNicoScraper(client=client, cache=cache), nn_batch_size, budget=budgets.get("niconico"), **options))
+    if ("bilibili" in services):
+        pipelines.append(BilibiliPipeline(db, BilibiliScraper(client=client, cache=cache), bb_batch_size, budget=budgets.get("bilibili"), **options))
+    return pipelines
+
+async def refresh_views(db: SongRepository, pipelines: List[ServicePipeline], requeue_dead_letters: bool = False):
+    """
+    Runs every service pipeline concurrently, so the slow ones don't hold up the rest.
+    """
+    await db.init_models()
+    backfilled = await db.backfill_video_ids()
+    if (backfilled):
+        logging.info(f"Filled video ids of {backfilled} song URLs")
+    if (requeue_dead_letters):
+        for pipeline in pipelines:
+            requeued = await db.requeue_dead_letters(pipeline.service_name)
+            logging.info(f"Requeued {requeued} dead-lettered {pipeline.service_name} song URLs")
+    await asyncio.gather(*(pipeline.run() for pipeline in pipelines))
+
+async def main(args: argparse.Namespace):
+    youtube_api_keys = [key for key in os.environ.get("YOUTUBE_API_KEYS", "").split(',') if key]
+
+    async with SongRepository(os.environ["DB_URL"]) as db:
+        async with metrics_reporting(args), profile_reporting(args), HttpClient() as client:
+            pipelines = build_pipelines(
+                db,
+                args.services,
+                youtube_api_keys,
+                args.yt_batch_size,
+                args.nn_batch_size,
+                args.bb_batch_size,
+                client,
+                ResponseCache(args.cache_dir) if (args.cache_dir) else None,
+                args.worker_id,
+                args.lease_seconds,
+                args.max_attempts,
+                args.refresh,
+                {"youtube": args.yt_budget, "niconico": args.nn_budget, "bilibili": args.bb_budget}
+            )
+            await refresh_views(db, pipelines, args.requeue_dead_letters)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s: %(message)s")
+    if sys.platform.startswith("win"):
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    asyncio.run(main(parse_args()))
@@ -3,18 +3,34 @@ import aiohttp
 import asyncio
 from typing import Tuple, List, Optional
 import logging
+from json import loads
 
 from utils.bvid import get_bv
+from utils.videoIds import bilibili_av_pattern
+from utils.rateLimiter import AdaptiveRateLimiter, get_rate_limiter
+from utils.httpClient import HttpClient, session_scope, classify_exception
+from utils.httpCache import ResponseCache, cached_get
+from utils.metrics import scraper_results
 
-from constants.states import ResponseState
+from constants.states import ResponseState, FailureReason
 
 class BilibiliScraper():
-    BASE_URL = "https://api.bilibili.com/x/web-interface/view?bvid="
+    BASE_URL = "https://api.bilibili.com/x/web-interface/view"
 
-    def __init__(self, user_agent: Optional[dict] = None):
+    def __init__(
+        self,
+        user_agent: Optional[dict] = None,
+        rate_limiter: Optional[AdaptiveRateLimiter] = None,
+        client: Optional[HttpClient] = None,
+        cache: Optional[ResponseCache] = None
+    ):
         self.logger = logging.getLogger(self.__class__.__name__)
         self.logger.setLevel(logging.DEBUG)
 
+        self.rate_limiter = rate_limiter or get_rate_limiter(self.BASE_URL)
+        self.client = client
+        self.cache = cache
+
         self.user_agent = {
             "User-Agent": (
                 "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
@@ -29,13 +45,19 @@ class BilibiliScraper():
             self.user_agent = user_agent
 
     def _get_video_url(self, vid: str):
-        return self.BASE_URL + get_bv(vid)
+        """
+        av ids are queried by aid, converting large ones to a bvid gives the wrong video.
+        """
+        search_av = bilibili_av_pattern.fullmatch(vid)
+        if (search_av is not None):
+            return f"{self.BASE_URL}?aid={search_av.group(1)}"
+        return f"{self.BASE_URL}?bvid={get_bv(vid)}"
     
     def _parse_json(self, json: dict) -> Tuple[ResponseState, dict]:
         code = json.get("code", None)
 
         if (code is None):
-            return (ResponseState.UNKNOWN, {})
+            return (ResponseState.UNKNOWN, {"error": FailureReason.PARSE})
         elif (code == 0):
             data = json.get("data", {})
             stats = data.get("stat", {})
@@ -60,23 +82,37 @@ class BilibiliScraper():
 
         self.logger.debug(json)          
 
-        return (ResponseState.UNKNOWN, {})
+        if (code == -412):
+            return (ResponseState.UNKNOWN, {"error": FailureReason.BLOCKED})
+        return (ResponseState.UNKNOWN, {"error": FailureReason.UNEXPECTED})
     
     async def _get_single_video_data(self, session: aiohttp.ClientSession, vid: str) -> Tuple[str, ResponseState, dict]:
+        res = None
         try:
-            async with session.get(self._get_video_url(vid), headers=self.user_agent) as res:
-                json = await res.json()
-                res_state, data = self._parse_json(json)
-                return (vid, res_state, data)
+            res = await cached_get(session, self._get_video_url(vid), self.cache, self.rate_limiter, headers=self.user_agent)
+            res_state, data = self._parse_json(loads(res.body))
         except Exception as e:
             self.logger.debug(e)
-            return (vid, ResponseState.UNKNOWN, {})
+            res_state, data = ResponseState.UNKNOWN, {"error": classify_exception(e)}
+
+        # -412 (request blocked) and other unexpected codes end up as UNKNOWN
+        scraper_results.inc(scraper="bilibili", state=res_state.name)
+        if (res is not None and not res.from_network):
+            return (vid, res_state, data)
+        if (res_state == ResponseState.UNKNOWN):
+            self.rate_limiter.on_throttle()
+        else:
+            self.rate_limiter.on_success()
+            if (self.cache is not None):
+                await self.cache.store(res)
+        return (vid, res_state, data)
 
     async def get_videos_data(self, ids: List[str]) -> List[Tuple[str, ResponseState, dict]]:
         """
-        Each video id inside ids should be an aid, not bvid.
+        Video ids are canonical ids of utils.videoIds, either BV... or av....
+        Requests are paced by the shared api.bilibili.com rate limiter.
         """
-        async with aiohttp.ClientSession() as session:
+        async with session_scope(self.client) as session:
             tasks = [
                 self._get_single_video_data(session, vid)
                 for vid in ids
@@ -1,18 +1,33 @@
 import xml.etree.ElementTree as ET
 import aiohttp
 import asyncio
-from typing import Tuple, List
+from typing import Tuple, List, Optional
 import logging
 
-from constants.states import ResponseState
+from constants.states import ResponseState, FailureReason
+
+from utils.rateLimiter import AdaptiveRateLimiter, get_rate_limiter
+from utils.httpClient import HttpClient, session_scope, classify_exception
+from utils.httpCache import ResponseCache, cached_get
+from utils.metrics import scraper_results
+from utils.profiling import span
 
 class NicoNicoScraper():
     BASE_URL = "https://ext.nicovideo.jp/api/getthumbinfo/"
 
-    def __init__(self):
+    def __init__(
+        self,
+        rate_limiter: Optional[AdaptiveRateLimiter] = None,
+        client: Optional[HttpClient] = None,
+        cache: Optional[ResponseCache] = None
+    ):
         self.logger = logging.getLogger(self.__class__.__name__)
         self.logger.setLevel(logging.DEBUG)
 
+        self.rate_limiter = rate_limiter or get_rate_limiter(self.BASE_URL)
+        self.client = client
+        self.cache = cache
+
     def test_logging(self):
         self.logger.debug("Debug")
         self.logger.info("Info")
@@ -49,23 +64,34 @@ class NicoNicoScraper():
 
             self.logger.debug(xml)          
 
-            return (ResponseState.UNKNOWN, {})
+            return (ResponseState.UNKNOWN, {"error": FailureReason.UNEXPECTED})
         except ET.ParseError:
             self.logger.debug(f"Parse error: {xml}")
-            return (ResponseState.UNKNOWN, {})
+            return (ResponseState.UNKNOWN, {"error": FailureReason.PARSE})
     
     async def _get_single_video_data(self, session: aiohttp.ClientSession, vid: str) -> Tuple[str, ResponseState, dict]:
+        res = None
         try:
-            async with session.get(self._get_video_url(vid)) as res:
-                xml = await res.text()
-                res_state, data = self._parse_xml_tree(xml)
-                return (vid, res_state, data)
+            res = await cached_get(session, self._get_video_url(vid), self.cache, self.rate_limiter)
+            with span("NicoNicoDouga.parse_xml"):
+                res_state, data = self._parse_xml_tree(res.body.decode("utf-8"))
         except Exception as e:
             self.logger.debug(e)
-            return (vid, ResponseState.UNKNOWN, {})
+            res_state, data = ResponseState.UNKNOWN, {"error": classify_exception(e)}
+
+        scraper_results.inc(scraper="niconico", state=res_state.name)
+        if (res is not None and not res.from_network):
+            return (vid, res_state, data)
+        if (res_state == ResponseState.UNKNOWN):
+            self.rate_limiter.on_throttle()
+        else:
+            self.rate_limiter.on_success()
+            if (self.cache is not None):
+                await self.cache.store(res)
+        return (vid, res_state, data)
 
     async def get_videos_data(self, ids: List[str]) -> List[Tuple[str, ResponseState, dict]]:
-        async with aiohttp.ClientSession() as session:
+        async with session_scope(self.client) as session:
             tasks = [
                 self._get_single_video_data(session, vid)
                 for vid in ids
@@ -0,0 +1,34 @@
+"""
+Decoding of VocaDB /api/songs responses. Songs stay the decoded dicts, which
+SongRepository takes as they are, only the song URLs of their PVs are built.
+orjson is used for decoding when it is installed (see requirements-optional.txt).
+"""
+import json
+from typing import Any, List
+
+from utils.videoIds import canonical_video_id
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(raw: bytes) -> Any:
+    if (orjson is not None):
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def song_urls_of(songs: List[dict]) -> List[dict]:
+    """
+    Rows for SongRepository.insert_song_urls, one per PV of the songs.
+    """
+    return [{
+        "pv_id": pv["id"],
+        "song_id": song["id"],
+        "url": pv["url"],
+        "service": pv["service"],
+        "video_id": canonical_video_id(pv["service"], pv["url"]),
+        "published_at": pv.get("publishDate", None)
+    } for song in songs for pv in (song.get("pvs") or [])]
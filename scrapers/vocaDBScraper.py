@@ -2,81 +2,320 @@ import asyncio
 import aiohttp
 import math
 import logging
+from typing import List, Optional, Tuple
 
 from tqdm import tqdm
 
 from db.db import SongRepository
 
+from utils.rateLimiter import AdaptiveRateLimiter, get_rate_limiter
+from utils.httpClient import HttpClient, session_scope
+from utils.httpCache import ResponseCache, cached_get
+from utils.metrics import scraper_results, queue_depth
+from utils.profiling import span
+
+from scrapers.vocaDBPages import loads, song_urls_of
+
 class VocaDBScraper:
+    BASE_URL = "https://vocadb.net/api/songs"
+
+    PAGE_SIZE = 100
 
-    def __init__(self, db_url: str, max_concurrent_batches: int = 10):
-        self.sem = asyncio.Semaphore(max_concurrent_batches)
+    FIELDS = "AdditionalNames,PVs,Artists,Bpm,Tags"
+
+    def __init__(
+        self,
+        db_url: str,
+        max_concurrent_batches: int = 10,
+        bulk_insert: bool = False,
+        client: Optional[HttpClient] = None,
+        rate_limiter: Optional[AdaptiveRateLimiter] = None,
+        cache: Optional[ResponseCache] = None,
+        write_batch_pages: int = 5
+    ):
+        """
+        bulk_insert switches page writes to the COPY-based path of SongRepository.
+        client is a shared HttpClient, without it every call opens its own session.
+        cache serves pages fetched by previous runs from disk.
+        write_batch_pages caps the pages written by a single transaction.
+        """
+        self.max_concurrent_batches = max_concurrent_batches
+        self.write_batch_pages = write_batch_pages
         self.db = SongRepository(db_url=db_url, echo=False)
+        self.bulk_insert = bulk_insert
+        self.rate_limiter = rate_limiter or get_rate_limiter(self.BASE_URL)
+        self.client = client
+        self.cache = cache
 
-    def gen_url(self, start: int = 0, size: int = 100):
-        url = f"https://vocadb.net/api/songs?childTags=false&unifyTypesAndTags=false&childVoicebanks=false&includeMembers=true&onlyWithPvs=false&start={start}&maxResults={size}&getTotalCount=true&sort=None&preferAccurateMatches=false&fields=AdditionalNames,PVs,Artists,Bpm,Tags"
+    def gen_url(self, start: int = 0, size: int = 100, sort: str = "None", fields: Optional[str] = FIELDS):
+        """
+        Without fields only the basic song properties (including version) are returned.
+        """
+        url = f"{self.BASE_URL}?childTags=false&unifyTypesAndTags=false&childVoicebanks=false&includeMembers=true&onlyWithPvs=false&start={start}&maxResults={size}&getTotalCount=true&sort={sort}&preferAccurateMatches=false"
+        if (fields):
+            url += f"&fields={fields}"
         return url
 
-    async def gen_urls(self, start: int = 0, size: int = 100):
+    def gen_song_url(self, song_id: int):
+        return f"{self.BASE_URL}/{song_id}?fields={self.FIELDS}"
+
+    async def gen_page_starts(self, start: int = 0, size: int = 100, revalidate: bool = False) -> List[int]:
         first_url = self.gen_url(start, size)
 
         logging.debug("Getting total count...")
-        async with aiohttp.ClientSession() as session:
-            total_count = (await self.fetch_url(session, first_url))['totalCount']
+        async with session_scope(self.client) as session:
+            data = await self.fetch_url(session, first_url, revalidate=revalidate)
+        if (data is None):
+            raise RuntimeError("Failed to get total count of songs")
+        total_count = data['totalCount']
         logging.debug(f"Total count: {total_count}")
 
         total_pages = math.ceil((total_count - start + 1) / size)
-        urls = [self.gen_url(i * 100, 100) for i in range(total_pages + 1)]
-        return urls
+        return [start + i * size for i in range(total_pages + 1)]
+
+    async def gen_urls(self, start: int = 0, size: int = 100):
+        return [self.gen_url(page_start, size) for page_start in await self.gen_page_starts(start, size)]
 
-    async def fetch_url(self, session: aiohttp.ClientSession, url: str):
+    async def fetch_url(self, session: aiohttp.ClientSession, url: str, revalidate: bool = False) -> Optional[dict]:
+        """
+        Returns None if the page couldn't be fetched, so it won't be checkpointed.
+        revalidate asks VocaDB whether a cached response is still current, see cached_get.
+        """
         try:
-            async with session.get(url, timeout=30) as res:
-                res.raise_for_status()
-                return await res.json()
+            res = await cached_get(session, url, self.cache, self.rate_limiter, revalidate=revalidate, timeout=30)
+            if (res.from_network and res.status in (429, 503)):
+                self.rate_limiter.on_throttle()
+            if (res.status != 200):
+                raise RuntimeError(f"Unexpected status {res.status}")
+            with span("vocadb.decode"):
+                data = loads(res.body)
+            if (res.from_network):
+                self.rate_limiter.on_success()
+                if (self.cache is not None):
+                    await self.cache.store(res)
+            scraper_results.inc(scraper="vocadb", state="SUCCESS")
+            return data
         except Exception as e:
+            scraper_results.inc(scraper="vocadb", state="UNKNOWN")
             logging.error(f"[ERROR] Failed fetching {url}: {e}")
-            return {"items": []}  # safe fallback
+            return None
 
-    async def process_url(self, session: aiohttp.ClientSession, url: str, pbar: tqdm = None):
-        async with self.sem:
-            try:
-                res = (await self.fetch_url(session, url)).get("items", [])
-                if (res):
-                    await self.db.insert_songs(res)
-                    song_urls_total = []
-                    for item in res:
-                        song_urls = [{
-                            "pv_id": pv["id"],
-                            "song_id": item["id"],
-                            "url": pv["url"],
-                            "service": pv["service"],
-                            "published_at": pv.get("publishDate", None)
-                        } for pv in item["pvs"]]
-                        if (song_urls):
-                            song_urls_total.extend(song_urls)
-                    if (song_urls_total):
-                        await self.db.insert_song_urls(song_urls_total)
-            except Exception as e:
-                logging.error(f"[ERROR] Processing {url} failed: {e}")
-            finally:
+    async def _produce(self, page_starts: List[int], pages: asyncio.Queue):
+        for page_start in page_starts:
+            await pages.put(page_start)
+        for _ in range(self.max_concurrent_batches):
+            await pages.put(None)
+
+    async def _fetch_pages(self, session: aiohttp.ClientSession, pages: asyncio.Queue, results: asyncio.Queue, pbar: tqdm = None):
+        while True:
+            page_start = await pages.get()
+            if (page_start is None):
+                break
+
+            data = await self.fetch_url(session, self.gen_url(page_start, self.PAGE_SIZE))
+            if (data is None):
                 if (pbar is not None):
-                    pbar.update(1)  # always advance progress bar
+                    pbar.update(1)
+                continue
+            await results.put((page_start, data.get("items", [])))
+            queue_depth.set(results.qsize(), pipeline="vocadb", queue="pages")
+        await results.put(None)
 
-    async def run(self, pbar: tqdm = None):
-        urls = await self.gen_urls(0, 100)
+    async def _write_pages(self, results: asyncio.Queue, pbar: tqdm = None):
+        """
+        Writes whatever pages are waiting, up to write_batch_pages, in one go,
+        so batches grow by themselves when the database is the slower side.
+        """
+        running_fetchers = self.max_concurrent_batches
+        while (running_fetchers > 0):
+            batch = []
+            item = await results.get()
+            while True:
+                if (item is None):
+                    running_fetchers -= 1
+                else:
+                    batch.append(item)
+                if (len(batch) >= self.write_batch_pages or results.empty() or running_fetchers == 0):
+                    break
+                item = results.get_nowait()
+            queue_depth.set(results.qsize(), pipeline="vocadb", queue="pages")
 
-        if (pbar is not None):
-            pbar.total = len(urls)
+            if (batch):
+                with span("vocadb.write"):
+                    await self.write_pages(batch)
+                if (pbar is not None):
+                    pbar.update(len(batch))
+
+    async def write_songs(self, songs: List[dict]):
+        if (not songs):
+            return
+        with span("vocadb.song_urls"):
+            song_urls_total = song_urls_of(songs)
+        if (self.bulk_insert):
+            await self.db.bulk_insert_songs_with_urls(songs, song_urls_total)
+        else:
+            await self.db.insert_songs(songs)
+            if (song_urls_total):
+                await self.db.insert_song_urls(song_urls_total)
+
+    async def write_pages(self, batch: List[Tuple[int, list]]):
+        """
+        batch holds (page_start, songs) pairs. Only full pages are checkpointed,
+        the last one may still grow.
+        """
+        songs = [song for _, page_songs in batch for song in page_songs]
+        try:
+            await self.write_songs(songs)
+            await self.db.mark_pages_completed(
+                [(page_start, len(page_songs)) for page_start, page_songs in batch if (len(page_songs) == self.PAGE_SIZE)],
+                self.PAGE_SIZE
+            )
+        except Exception as e:
+            logging.error(f"[ERROR] Writing pages {[page_start for page_start, _ in batch]} failed: {e}")
 
+    async def run(self, pbar: tqdm = None, resume: bool = True):
+        """
+        With resume enabled, pages checkpointed by previous runs are skipped.
+        Pages stream through a producer, max_concurrent_batches fetch workers and
+        a single DB writer linked by bounded queues, so memory stays flat and
+        downloads continue while the writer commits.
+        """
         await self.db.init_models()
 
+        page_starts = await self.gen_page_starts(0, self.PAGE_SIZE)
+
+        if (resume):
+            completed = await self.db.get_completed_page_starts(self.PAGE_SIZE)
+            page_starts = [page_start for page_start in page_starts if page_start not in completed]
+            logging.debug(f"Skipping {len(completed)} already completed pages")
+        else:
+            await self.db.reset_crawl_checkpoints()
+
+        if (pbar is not None):
+            pbar.total = len(page_starts)
+
         logging.debug("Starting fetching songs...")
-        async with aiohttp.ClientSession() as session:
+        pages = asyncio.Queue(maxsize=self.max_concurrent_batches * 2)
+        results = asyncio.Queue(maxsize=self.write_batch_pages * 2)
+        async with session_scope(self.client) as session:
             tasks = [
-                asyncio.create_task(self.process_url(session, url, pbar))
-                for url in urls
+                asyncio.create_task(self._produce(page_starts, pages)),
+                *(asyncio.create_task(self._fetch_pages(session, pages, results, pbar)) for _ in range(self.max_concurrent_batches)),
+                asyncio.create_task(self._write_pages(results, pbar))
             ]
-            await asyncio.gather(*tasks)
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                # Stages left behind would wait forever on queues nobody serves anymore
+                for task in tasks:
+                    task.cancel()
+                raise
+
+        logging.debug("Fetching completed!")
+
+    async def _sync_additions(self, session: aiohttp.ClientSession, known_max_id: int) -> int:
+        """
+        Pages through the newest additions until a page reaches known songs.
+        Pages can't be skipped, the stop condition depends on every one of them.
+        Sync requests revalidate cached responses, a page of the previous sync would add nothing.
+        """
+        added = 0
+        page_start = 0
+        while True:
+            data = await self.fetch_url(session, self.gen_url(page_start, self.PAGE_SIZE, sort="AdditionDate"), revalidate=True)
+            if (data is None):
+                raise RuntimeError(f"Failed to fetch additions page {page_start}")
+            songs = data.get("items", [])
+            new_songs = [song for song in songs if (song["id"] > known_max_id)]
+            with span("vocadb.write"):
+                await self.write_songs(new_songs)
+            added += len(new_songs)
+            if (len(new_songs) < len(songs) or len(songs) < self.PAGE_SIZE):
+                return added
+            page_start += self.PAGE_SIZE
+
+    async def _fetch_song(self, session: aiohttp.ClientSession, song_id: int, semaphore: asyncio.Semaphore) -> Optional[dict]:
+        async with semaphore:
+            return await self.fetch_url(session, self.gen_song_url(song_id), revalidate=True)
+
+    async def _sync_edits(
+        self,
+        session: aiohttp.ClientSession,
+        pages: asyncio.Queue,
+        write_lock: asyncio.Lock,
+        details: asyncio.Semaphore,
+        pbar: tqdm = None
+    ) -> int:
+        """
+        Compares the versions of light pages (no fields) with the stored ones and
+        re-fetches full details of songs that differ or are missing, at most
+        details requests at once across every worker.
+        A page that can't be fetched is skipped, its edits are found by the next sync.
+        """
+        updated = 0
+        while True:
+            page_start = await pages.get()
+            if (page_start is None):
+                return updated
 
-        logging.debug("Fetching completed!")
\ No newline at end of file
+            data = await self.fetch_url(session, self.gen_url(page_start, self.PAGE_SIZE, fields=None), revalidate=True)
+            if (data is not None):
+                versions = {item["id"]: item.get("version") for item in data.get("items", [])}
+                stored = await self.db.get_song_versions(list(versions))
+                changed = [
+                    song_id for song_id, version in versions.items()
+                    if (song_id not in stored or stored[song_id] != version)
+                ]
+                fetched = await asyncio.gather(*(self._fetch_song(session, song_id, details) for song_id in changed))
+                songs = [song for song in fetched if (song is not None)]
+                if (songs):
+                    # Concurrent catalogue upserts of shared artists and tags could deadlock
+                    async with write_lock:
+                        with span("vocadb.write"):
+                            await self.write_songs(songs)
+                updated += len(songs)
+            if (pbar is not None):
+                pbar.update(1)
+
+    async def sync(self, pbar: tqdm = None, check_edits: bool = True):
+        """
+        Delta sync for catalogues that were crawled before. New songs are read
+        newest first until the highest stored id is reached, then (with check_edits)
+        every song's version is compared with light pages and only changed songs
+        are fetched in full. Without stored songs it falls back to run().
+        """
+        await self.db.init_models()
+        known_max_id = await self.db.get_max_song_id()
+        if (known_max_id is None):
+            logging.info("No songs are stored yet, running a full crawl")
+            await self.run(pbar=pbar)
+            return
+
+        async with session_scope(self.client) as session:
+            added = await self._sync_additions(session, known_max_id)
+            logging.info(f"Added {added} new songs")
+            if (not check_edits):
+                return
+
+            page_starts = await self.gen_page_starts(0, self.PAGE_SIZE, revalidate=True)
+            if (pbar is not None):
+                pbar.total = len(page_starts)
+            pages = asyncio.Queue()
+            for page_start in page_starts:
+                pages.put_nowait(page_start)
+            for _ in range(self.max_concurrent_batches):
+                pages.put_nowait(None)
+
+            write_lock = asyncio.Lock()
+            details = asyncio.Semaphore(self.max_concurrent_batches)
+            tasks = [
+                asyncio.create_task(self._sync_edits(session, pages, write_lock, details, pbar))
+                for _ in range(self.max_concurrent_batches)
+            ]
+            try:
+                updated = sum(await asyncio.gather(*tasks))
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                raise
+            logging.info(f"Updated {updated} changed songs")
@@ -1,75 +1,171 @@
 """
 Async Youtube v3 API video data scraper, requires API keys.
-1 clear API key will be enough for approx. 500,000 videos.
+1 clear API key will be enough for approx. 500,000 videos,
+several keys are used in parallel.
 """
 import aiohttp
 import asyncio
-import itertools
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
+from urllib.parse import urlparse
 import logging
 
+from utils.rateLimiter import AdaptiveRateLimiter
+from utils.quotaManager import QuotaManager, QuotaExhaustedError
+from utils.httpClient import HttpClient, session_scope, classify_exception
+from utils.metrics import scraper_results
+
 class YouTubeScraper:
     BASE_URL = "https://www.googleapis.com/youtube/v3/videos"
 
-    def __init__(self, api_keys: List[str], quota_retry_wait: int = 60, max_concurrent_batches: int = 10):
-        if (not api_keys):
-            raise ValueError("At least one API key is required")
-        
+    # videos.list costs a single unit whatever the number of ids
+    REQUEST_COST = 1
+    QUOTA_REASONS = ("quotaExceeded", "dailyLimitExceeded")
+
+    def __init__(
+        self,
+        api_keys: List[str],
+        quota_retry_wait: int = 60,
+        max_concurrent_per_key: int = 10,
+        rate_limiter: Optional[AdaptiveRateLimiter] = None,
+        client: Optional[HttpClient] = None,
+        daily_quota: int = 10000,
+        max_retries: int = 3,
+        retry_backoff: float = 1.0
+    ):
+        """
+        Chunks are spread over every key in parallel, see utils.quotaManager.
+        Keys out of quota are parked until the daily reset, rate limited ones for
+        quota_retry_wait seconds. If every key is parked for longer than that,
+        fetch_videos_stats raises QuotaExhaustedError.
+        rate_limiter is shared by every key if given, otherwise each key has its own.
+        Server errors are retried max_retries times, waiting retry_backoff seconds
+        and doubling it after every attempt.
+        """
         self.logger = logging.getLogger(self.__class__.__name__)
         self.logger.setLevel(logging.DEBUG)
         
-        self.api_keys = itertools.cycle(api_keys)
-        self.current_key = next(self.api_keys)
+        self.quota = QuotaManager(api_keys, daily_quota, rate_limiter, urlparse(self.BASE_URL).hostname)
         self.quota_retry_wait = quota_retry_wait
-        self.max_concurrent_batches = max_concurrent_batches
+        self.max_concurrent_per_key = max_concurrent_per_key
+        self.client = client
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
 
-    async def _fetch_chunk(self, session: aiohttp.ClientSession, video_ids: List[str], part: str) -> List[Dict[str, Any]]:
-        params = {
-            "part": part,
-            "id": ",".join(video_ids),
-            "key": self.current_key,
-        }
+    @staticmethod
+    async def _error_reason(resp: aiohttp.ClientResponse) -> Optional[str]:
+        try:
+            data = await resp.json(content_type=None)
+            return data["error"]["errors"][0]["reason"]
+        except Exception:
+            return None
 
+    async def _fetch_chunk(self, session: aiohttp.ClientSession, video_ids: List[str], part: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        Returns None if the request was rejected because of quota or rate limits.
+        Server errors are retried with backoff, other statuses raise ClientResponseError.
+        """
+        attempt = 0
         while True:
+            try:
+                return await self._request_chunk(session, video_ids, part)
+            except aiohttp.ClientResponseError as e:
+                if (e.status < 500 or attempt >= self.max_retries):
+                    raise
+                delay = self.retry_backoff * 2 ** attempt
+                attempt += 1
+                self.logger.debug(f"Status {e.status} for chunk starting at video {video_ids[0]}, retrying in {delay}s")
+            await asyncio.sleep(delay)
+
+    async def _request_chunk(self, session: aiohttp.ClientSession, video_ids: List[str], part: str) -> Optional[List[Dict[str, Any]]]:
+        key = await self.quota.acquire(self.REQUEST_COST, self.quota_retry_wait)
+        try:
+            params = {
+                "part": part,
+                "id": ",".join(video_ids),
+                "key": key.key,
+            }
+
+            await key.rate_limiter.acquire()
             async with session.get(self.BASE_URL, params=params) as resp:
                 if (resp.status == 200):
+                    key.rate_limiter.on_success()
                     data = await resp.json()
-                    return data.get("items", [])
+                    items = data.get("items", [])
+                    scraper_results.inc(len(items), scraper="youtube", state="SUCCESS")
+                    scraper_results.inc(len(video_ids) - len(items), scraper="youtube", state="NOT_FOUND")
+                    return items
                 elif (resp.status in (403, 429)):
-                    self.logger.info(f"Quota exhausted for key {self.current_key}, switching...")
-                    self.current_key = next(self.api_keys)
-                    params["key"] = self.current_key
-                    await asyncio.sleep(self.quota_retry_wait)
+                    key.rate_limiter.on_throttle()
+                    scraper_results.inc(len(video_ids), scraper="youtube", state="UNKNOWN")
+                    if (await self._error_reason(resp) in self.QUOTA_REASONS):
+                        self.quota.park_until_reset(key)
+                    else:
+                        self.quota.park(key, self.quota_retry_wait)
+                    return None
                 elif (resp.status == 404):
+                    scraper_results.inc(len(video_ids), scraper="youtube", state="NOT_FOUND")
                     return []
                 else:
+                    scraper_results.inc(len(video_ids), scraper="youtube", state="UNKNOWN")
                     text = await resp.text()
-                    raise RuntimeError(f"Unexpected status {resp.status}: {text}")
+                    raise aiohttp.ClientResponseError(
+                        resp.request_info,
+                        resp.history,
+                        status=resp.status,
+                        message=text[:200]
+                    )
+        finally:
+            self.quota.release(key)
 
     async def fetch_videos_stats(
         self,
         video_ids: List[str],
         batch_size: int = 50,
         part: str = "statistics"
-    ) -> List[Dict[str, Any]]:
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
+        """
+        Returns the items of every chunk that succeeded and a FailureReason value
+        for the videos of chunks that didn't, those are missing from the items
+        but aren't deleted. QuotaExhaustedError cancels the remaining chunks.
+        """
         if (batch_size > 50):
             raise ValueError("YouTube API only allows up to 50 IDs per request")
 
         chunks = [video_ids[i:i + batch_size] for i in range(0, len(video_ids), batch_size)]
         results: List[Dict[str, Any]] = []
+        failures: Dict[str, str] = {}
 
-        semaphore = asyncio.Semaphore(self.max_concurrent_batches)
+        semaphore = asyncio.Semaphore(self.max_concurrent_per_key * len(self.quota))
 
-        async with aiohttp.ClientSession() as session:
+        async with session_scope(self.client) as session:
 
             async def sem_fetch(chunk):
-                async with semaphore:
-                    return await self._fetch_chunk(session, chunk, part)
+                while True:
+                    # A rejected chunk is retried right away on another key,
+                    # waiting for parked keys happens inside QuotaManager.acquire
+                    async with semaphore:
+                        try:
+                            items = await self._fetch_chunk(session, chunk, part)
+                        except QuotaExhaustedError:
+                            raise
+                        except Exception as e:
+                            self.logger.error(f"Fetching chunk starting at video {chunk[0]} failed: {e}")
+                            reason = classify_exception(e).value
+                            failures.update({video_id: reason for video_id in chunk})
+                            return []
+                    if (items is not None):
+                        return items
 
-            tasks = [sem_fetch(chunk) for chunk in chunks]
-            all_results = await asyncio.gather(*tasks)
+            tasks = [asyncio.create_task(sem_fetch(chunk)) for chunk in chunks]
+            try:
+                all_results = await asyncio.gather(*tasks)
+            except BaseException:
+                # Chunks left running would keep spending quota
+                for task in tasks:
+                    task.cancel()
+                raise
 
         for batch in all_results:
             results.extend(batch)
 
-        return results
+        return (results, failures)
@@ -0,0 +1,273 @@
+"""
+SQL of SongRepository (upserts, leases, failure backoff and the refresh
+schedule) against a throwaway SQLite database, and against PostgreSQL when
+TEST_PG_URL points at a scratch database (its tables are emptied), e.g.
+TEST_PG_URL=postgresql+psycopg://postgres@localhost/scratch python -m pytest
+"""
+import asyncio
+import os
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import func, select, text, update
+
+from db.db import SongRepository, Song, SongURL, SongURLStatsSnapshot
+
+
+def song(song_id: int) -> dict:
+    return {"id": song_id, "name": f"Song {song_id}", "pvs": [], "artists": [], "tags": []}
+
+
+def song_url(pv_id: int, song_id: int, video_id: str, service: str = "Youtube") -> dict:
+    return {
+        "pv_id": pv_id,
+        "song_id": song_id,
+        "url": f"https://youtu.be/{video_id}",
+        "service": service,
+        "video_id": video_id,
+        "published_at": "2020-01-01T00:00:00",
+    }
+
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def db_url(request, tmp_path) -> str:
+    if (request.param == "sqlite"):
+        pytest.importorskip("aiosqlite")
+        return f"sqlite+aiosqlite:///{tmp_path / 'songs.db'}"
+    url = os.environ.get("TEST_PG_URL")
+    if (not url):
+        pytest.skip("TEST_PG_URL isn't set")
+    return url
+
+
+@pytest.fixture
+def run(db_url):
+    """
+    Runs a scenario against a fresh repository inside a single event loop,
+    aiosqlite connections can't move between loops.
+    """
+    def run_scenario(scenario):
+        async def main():
+            db = SongRepository(db_url)
+            try:
+                await db.init_models()
+                if (not db.sqlite):
+                    async with db.engine.begin() as conn:
+                        await conn.execute(text(
+                            "TRUNCATE songs, songurls, crawl_checkpoints, songurl_stats_history, artists, tags CASCADE"
+                        ))
+                await db.insert_songs([song(1), song(2), song(3)])
+                await db.insert_song_urls([
+                    song_url(10, 1, "shared"),
+                    song_url(20, 2, "shared"),
+                    song_url(30, 3, "single"),
+                ])
+                await scenario(db)
+            finally:
+                await db.engine.dispose()
+        asyncio.run(main())
+    return run_scenario
+
+
+async def song_urls(db: SongRepository) -> dict:
+    async with db.session_factory() as session:
+        rows = (await session.execute(select(SongURL))).scalars().all()
+    return {row.pv_id: row for row in rows}
+
+
+async def set_song_urls(db: SongRepository, **values):
+    async with db.session_factory() as session:
+        await session.execute(update(SongURL).values(**values))
+        await session.commit()
+
+
+def test_song_urls_upsert_keeps_statistics(run):
+    async def scenario(db):
+        await db.update_song_urls_by_video_ids("Youtube", [{"video_id": "single", "views": 5}])
+        moved = song_url(30, 3, "single")
+        moved["url"] = "https://www.youtube.com/watch?v=single"
+        await db.insert_song_urls([moved, moved])
+
+        rows = await song_urls(db)
+        assert len(rows) == 3
+        assert rows[30].url == moved["url"]
+        assert rows[30].views == 5
+    run(scenario)
+
+
+def test_statistics_reach_every_row_of_a_video_and_the_totals(run):
+    async def scenario(db):
+        await db.update_song_urls_by_video_ids("Youtube", [{"video_id": "shared", "views": 100, "likes": 7}])
+
+        rows = await song_urls(db)
+        assert (rows[10].views, rows[20].views, rows[30].views) == (100, 100, None)
+        assert rows[10].likes == 7
+        async with db.session_factory() as session:
+            totals = dict((await session.execute(select(Song.id, Song.totalViews))).all())
+        assert totals == {1: 100, 2: 100, 3: None}
+    run(scenario)
+
+
+def test_statistics_written_in_several_chunks(run):
+    async def scenario(db):
+        await db.update_song_urls_by_video_ids(
+            "Youtube",
+            [{"video_id": "shared", "views": 100}, {"video_id": "single", "views": 5}],
+            chunk_size=1
+        )
+
+        rows = await song_urls(db)
+        assert (rows[10].views, rows[20].views, rows[30].views) == (100, 100, 5)
+        async with db.session_factory() as session:
+            totals = dict((await session.execute(select(Song.id, Song.totalViews))).all())
+            snapshots = (await session.execute(select(func.count()).select_from(SongURLStatsSnapshot))).scalar_one()
+        assert totals == {1: 100, 2: 100, 3: 5}
+        assert snapshots == 3
+    run(scenario)
+
+
+def test_leases_dont_overlap_and_can_be_released(run):
+    async def scenario(db):
+        first = await db.lease_video_ids("Youtube", "worker-1", batch_size=1)
+        second = await db.lease_video_ids("Youtube", "worker-2", batch_size=5)
+        assert len(first) == 1
+        assert set(first).isdisjoint(second)
+        assert set(first) | set(second) == {"shared", "single"}
+        assert await db.lease_video_ids("Youtube", "worker-3", batch_size=5) == []
+
+        await db.release_video_ids("Youtube", "worker-1", first)
+        assert await db.lease_video_ids("Youtube", "worker-3", batch_size=5) == first
+    run(scenario)
+
+
+def test_leases_count_videos_not_rows(run):
+    async def scenario(db):
+        assert await db.lease_video_ids("Youtube", "worker-1", batch_size=1) == ["shared"]
+
+        rows = await song_urls(db)
+        assert (rows[10].lease_owner, rows[20].lease_owner, rows[30].lease_owner) == ("worker-1", "worker-1", None)
+    run(scenario)
+
+
+def test_concurrent_leases_dont_overlap(run):
+    async def scenario(db):
+        leased = await asyncio.gather(*(
+            db.lease_video_ids("Youtube", f"worker-{i}", batch_size=1) for i in range(4)
+        ))
+        claimed = [video_id for video_ids in leased for video_id in video_ids]
+        assert len(claimed) == len(set(claimed))
+        assert await db.lease_video_ids("Youtube", "worker-5", batch_size=5) == sorted({"shared", "single"} - set(claimed))
+    run(scenario)
+
+
+def test_expired_leases_can_be_claimed_again(run):
+    async def scenario(db):
+        assert await db.lease_video_ids("Youtube", "worker-1", batch_size=5, lease_seconds=-1) == ["shared", "single"]
+        assert await db.lease_video_ids("Youtube", "worker-2", batch_size=5) == ["shared", "single"]
+    run(scenario)
+
+
+def test_written_statistics_end_the_lease(run):
+    async def scenario(db):
+        await db.lease_video_ids("Youtube", "worker-1", batch_size=5)
+        await db.update_song_urls_by_video_ids("Youtube", [{"video_id": "single", "views": 1}])
+
+        rows = await song_urls(db)
+        assert (rows[30].lease_owner, rows[30].leased_until) == (None, None)
+        assert rows[10].lease_owner == "worker-1"
+    run(scenario)
+
+
+def test_failures_back_off_and_dead_letter(run):
+    async def scenario(db):
+        await db.record_fetch_failures("Youtube", {"single": "timeout"}, max_attempts=2, backoff_seconds=300)
+
+        rows = await song_urls(db)
+        assert (rows[30].fetch_attempts, rows[30].last_error) == (1, "timeout")
+        assert rows[30].next_attempt_at is not None and rows[30].dead_lettered_at is None
+        # Backing off, so neither the cursor nor a lease picks it up
+        assert await db.fetch_unprocessed_video_ids("Youtube", 5) == ["shared"]
+        assert await db.lease_video_ids("Youtube", "worker-1", batch_size=5) == ["shared"]
+
+        await db.record_fetch_failures("Youtube", {"single": "http_status"}, max_attempts=2, backoff_seconds=300)
+        rows = await song_urls(db)
+        assert rows[30].fetch_attempts == 2
+        assert rows[30].next_attempt_at - rows[30].updated_at >= timedelta(seconds=590)
+        assert rows[30].dead_lettered_at is not None
+        assert await db.fetch_dead_letters("Youtube") == [("Youtube", "single", "http_status", 2)]
+
+        assert await db.requeue_dead_letters("Youtube") == 1
+        db.reset_video_ids_batches("Youtube")
+        assert await db.fetch_unprocessed_video_ids("Youtube", 5) == ["shared", "single"]
+    run(scenario)
+
+
+def test_successful_write_resets_the_retry_budget(run):
+    async def scenario(db):
+        await db.record_fetch_failures("Youtube", {"single": "timeout"}, max_attempts=1)
+        await db.update_song_urls_by_video_ids("Youtube", [{"video_id": "single", "views": 3}])
+
+        row = (await song_urls(db))[30]
+        assert (row.fetch_attempts, row.last_error, row.next_attempt_at, row.dead_lettered_at) == (0, None, None, None)
+    run(scenario)
+
+
+def test_refresh_is_scheduled_within_bounds(run):
+    async def scenario(db):
+        await db.update_song_urls_by_video_ids("Youtube", [
+            {"video_id": "shared", "views": 10_000_000},
+            {"video_id": "single", "views": 0},
+        ])
+
+        rows = await song_urls(db)
+        for row in rows.values():
+            interval = row.next_refresh_at - row.refreshed_at
+            assert timedelta(hours=5.9) <= interval <= timedelta(days=90, minutes=1)
+        # Many views per day are refreshed sooner than none
+        assert rows[10].next_refresh_at < rows[30].next_refresh_at
+        assert await db.lease_due_video_ids("Youtube", "worker-1", batch_size=5) == []
+
+        await set_song_urls(db, next_refresh_at=rows[30].refreshed_at - timedelta(days=1))
+        assert await db.lease_due_video_ids("Youtube", "worker-1", batch_size=5) == ["shared", "single"]
+    run(scenario)
+
+
+def test_bulk_insert_upserts_songs_and_urls(run):
+    async def scenario(db):
+        await db.update_song_urls_by_video_ids("Youtube", [{"video_id": "single", "views": 5}])
+        added = song(4)
+        added["pvs"] = [{"id": 40, "service": "Youtube", "url": "https://youtu.be/new"}]
+        added["tags"] = [{"tag": {"id": 1, "name": "rock"}, "count": 2}]
+        moved = song_url(30, 3, "single")
+        moved["url"] = "https://www.youtube.com/watch?v=single"
+        await db.bulk_insert_songs_with_urls([added, song(3)], [song_url(40, 4, "new"), moved])
+
+        rows = await song_urls(db)
+        assert (rows[30].url, rows[30].views) == (moved["url"], 5)
+        assert (rows[40].song_id, rows[40].video_id) == (4, "new")
+        async with db.session_factory() as session:
+            stored = await session.get(Song, 4)
+        assert (stored.pvs, stored.tags) == (added["pvs"], added["tags"])
+    run(scenario)
+
+
+def test_stray_history_rows_get_their_partition(run):
+    async def scenario(db):
+        if (db.sqlite):
+            pytest.skip("the history is a plain table on SQLite")
+        async with db.engine.begin() as conn:
+            await conn.execute(text("DROP TABLE IF EXISTS songurl_stats_history_2090_03"))
+            await conn.execute(text(
+                "INSERT INTO songurl_stats_history (songurl_id, captured_at, views) "
+                "SELECT id, '2090-03-15', 1 FROM songurls"
+            ))
+        await db.ensure_stats_history_partitions()
+
+        async with db.engine.begin() as conn:
+            partition = await conn.execute(text("SELECT count(*) FROM songurl_stats_history_2090_03"))
+            default = await conn.execute(text(
+                "SELECT count(*) FROM songurl_stats_history_default WHERE captured_at >= :start"
+            ), {"start": date(2090, 3, 1)})
+            assert (partition.scalar_one(), default.scalar_one()) == (3, 0)
+            await conn.execute(text("DROP TABLE songurl_stats_history_2090_03"))
+    run(scenario)
@@ -0,0 +1,31 @@
+"""
+What UpdateBuffer hands over to the repository when it flushes.
+"""
+import asyncio
+
+from db.updateBuffer import UpdateBuffer
+
+
+class RecordingRepository:
+    def __init__(self):
+        self.updates = []
+        self.failures = {}
+
+    async def update_song_urls_by_video_ids(self, service_name, updates):
+        self.updates.extend(updates)
+
+    async def record_fetch_failures(self, service_name, failures, max_attempts, backoff_seconds):
+        self.failures.update(failures)
+
+
+def test_flush_drops_failures_of_videos_updated_in_the_same_window():
+    async def main():
+        db = RecordingRepository()
+        async with UpdateBuffer(db, "Youtube", flush_interval=60) as buffer:
+            await buffer.add([], {"a": "timeout", "b": "timeout"})
+            await buffer.add([{"video_id": "a", "views": 1}], {})
+        return db
+
+    db = asyncio.run(main())
+    assert db.updates == [{"video_id": "a", "views": 1}]
+    assert db.failures == {"b": "timeout"}
@@ -0,0 +1,175 @@
+"""
+Persistent response cache shared by the scrapers. Bodies are stored gzip-compressed
+on disk, keyed by URL, and stay fresh for a per-host TTL. Stale entries are
+revalidated with If-None-Match/If-Modified-Since, so unchanged pages cost a 304.
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import time
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import aiohttp
+from yarl import URL
+
+from utils.metrics import registry
+from utils.rateLimiter import AdaptiveRateLimiter
+
+cache_results = registry.counter(
+    "http_cache_results_total",
+    "Cached requests by host and result (hit, revalidated, miss)"
+)
+
+# Seconds an entry is served without asking the server again
+host_ttls: Dict[str, float] = {
+    "vocadb.net": 24 * 3600,
+    "ext.nicovideo.jp": 6 * 3600,
+    "api.bilibili.com": 6 * 3600,
+}
+default_ttl = 3600
+
+
+class CachedResponse:
+    __slots__ = ("url", "status", "body", "etag", "last_modified", "stored_at", "from_network")
+
+    def __init__(
+        self,
+        url: str,
+        status: int,
+        body: bytes,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        stored_at: Optional[float] = None,
+        from_network: bool = True
+    ):
+        self.url = url
+        self.status = status
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored_at = stored_at
+        self.from_network = from_network
+
+
+class ResponseCache:
+    def __init__(self, directory: str, ttls: Optional[Dict[str, float]] = None, compress_level: int = 6):
+        """
+        ttls overrides host_ttls for some hosts, other hosts use default_ttl.
+        """
+        self.directory = directory
+        self.ttls = {**host_ttls, **(ttls or {})}
+        self.compress_level = compress_level
+        os.makedirs(directory, exist_ok=True)
+
+    def ttl_for(self, url: str) -> float:
+        return self.ttls.get(urlparse(url).hostname, default_ttl)
+
+    def _path(self, url: str) -> str:
+        digest = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + ".gz")
+
+    def _read(self, url: str) -> Optional[CachedResponse]:
+        try:
+            with open(self._path(url), "rb") as file:
+                raw = gzip.decompress(file.read())
+        except (OSError, EOFError):
+            return None
+        header, _, body = raw.partition(b"\n")
+        meta = json.loads(header)
+        if (meta["url"] != url):
+            return None
+        return CachedResponse(url, meta["status"], body, meta["etag"], meta["last_modified"], meta["stored_at"], False)
+
+    def _write(self, response: CachedResponse):
+        path = self._path(response.url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        header = json.dumps({
+            "url": response.url,
+            "status": response.status,
+            "etag": response.etag,
+            "last_modified": response.last_modified,
+            "stored_at": response.stored_at,
+        }).encode("utf-8")
+        # Write to a temporary file first, so readers never see half an entry
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(gzip.compress(header + b"\n" + response.body, self.compress_level))
+        os.replace(tmp_path, path)
+
+    async def load(self, url: str) -> Optional[CachedResponse]:
+        return await asyncio.to_thread(self._read, url)
+
+    async def store(self, response: CachedResponse):
+        """
+        Saves a response fetched from the network. Callers decide whether the body
+        is worth keeping, e.g. rate limit errors returned with status 200 aren't.
+        """
+        if (not response.from_network or response.status != 200):
+            return
+        response.stored_at = time.time()
+        await asyncio.to_thread(self._write, response)
+
+    def is_fresh(self, response: CachedResponse) -> bool:
+        return time.time() - response.stored_at < self.ttl_for(response.url)
+
+    @staticmethod
+    def conditional_headers(response: CachedResponse) -> Dict[str, str]:
+        headers = {}
+        if (response.etag):
+            headers["If-None-Match"] = response.etag
+        if (response.last_modified):
+            headers["If-Modified-Since"] = response.last_modified
+        return headers
+
+
+async def cached_get(
+    session: aiohttp.ClientSession,
+    url: str,
+    cache: Optional[ResponseCache] = None,
+    rate_limiter: Optional[AdaptiveRateLimiter] = None,
+    params: Optional[dict] = None,
+    headers: Optional[dict] = None,
+    revalidate: bool = False,
+    **kwargs
+) -> CachedResponse:
+    """
+    GETs url, serving fresh entries of cache from disk. The rate limiter is only
+    acquired when the request goes to the network, check from_network before
+    feeding it back. Responses aren't stored here, call cache.store once the body
+    turned out to be valid. With revalidate, cached entries are only served after
+    the server confirmed them with 304, however fresh they are.
+    """
+    if (params):
+        url = str(URL(url).update_query(params))
+    host = urlparse(url).hostname
+
+    cached = await cache.load(url) if (cache is not None) else None
+    if (cached is not None and not revalidate and cache.is_fresh(cached)):
+        cache_results.inc(host=host, result="hit")
+        return cached
+
+    request_headers = dict(headers or {})
+    if (cached is not None):
+        request_headers.update(cache.conditional_headers(cached))
+
+    if (rate_limiter is not None):
+        await rate_limiter.acquire()
+    async with session.get(url, headers=request_headers, **kwargs) as res:
+        if (res.status == 304 and cached is not None):
+            cache_results.inc(host=host, result="revalidated")
+            # The body didn't change, storing it again only renews its freshness
+            cached.from_network = True
+            return cached
+
+        if (cache is not None):
+            cache_results.inc(host=host, result="miss")
+        return CachedResponse(
+            url,
+            res.status,
+            await res.read(),
+            res.headers.get("ETag"),
+            res.headers.get("Last-Modified")
+        )
@@ -0,0 +1,101 @@
+"""
+Long-lived pooled HTTP client shared by the scrapers, so batches reuse
+TCP/TLS connections and DNS lookups instead of paying for them on every call.
+"""
+import asyncio
+import aiohttp
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional
+
+from constants.states import FailureReason
+
+from utils.metrics import metrics_trace_config
+
+
+default_timeout = aiohttp.ClientTimeout(total=60, connect=10, sock_read=30)
+
+
+class HttpClient:
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 20,
+        keepalive_timeout: float = 60,
+        dns_cache_ttl: int = 600,
+        timeout: aiohttp.ClientTimeout = default_timeout,
+        trace_configs: Optional[List[aiohttp.TraceConfig]] = None
+    ):
+        """
+        limit_per_host caps open connections to every host, connections are kept
+        alive for keepalive_timeout seconds and resolved hosts are cached for dns_cache_ttl seconds.
+        trace_configs are attached to the session next to the one recording
+        http_request_duration_seconds per host.
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.timeout = timeout
+        self.trace_configs = [metrics_trace_config()] + (trace_configs or [])
+
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if (self._session is None or self._session.closed):
+            raise RuntimeError("HttpClient is not open, use 'async with HttpClient()' or 'await client.open()'")
+        return self._session
+
+    async def open(self) -> "HttpClient":
+        if (self._session is None or self._session.closed):
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                use_dns_cache=True,
+                ttl_dns_cache=self.dns_cache_ttl
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                trace_configs=self.trace_configs
+            )
+        return self
+
+    async def close(self):
+        if (self._session is not None and not self._session.closed):
+            await self._session.close()
+        self._session = None
+
+    async def __aenter__(self) -> "HttpClient":
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+@asynccontextmanager
+async def session_scope(client: Optional[HttpClient] = None) -> AsyncIterator[aiohttp.ClientSession]:
+    """
+    Yields the shared session of client, or a short-lived one if no client was given.
+    """
+    if (client is not None):
+        yield client.session
+    else:
+        async with aiohttp.ClientSession(timeout=default_timeout, trace_configs=[metrics_trace_config()]) as session:
+            yield session
+
+
+def classify_exception(e: BaseException) -> FailureReason:
+    """
+    Maps an exception raised while fetching a video to the reason stored in songurls.last_error.
+    """
+    if (isinstance(e, asyncio.TimeoutError)):
+        return FailureReason.TIMEOUT
+    if (isinstance(e, aiohttp.ClientResponseError)):
+        return FailureReason.HTTP_STATUS
+    if (isinstance(e, aiohttp.ClientError)):
+        return FailureReason.NETWORK
+    if (isinstance(e, (ValueError, UnicodeDecodeError))):
+        return FailureReason.PARSE
+    return FailureReason.UNEXPECTED
@@ -0,0 +1,242 @@
+"""
+Minimal in-process metrics: counters, gauges and histograms with labels,
+exposed as a Prometheus text endpoint or dumped periodically as JSON.
+Everything records into the module-level registry, so scrapers, pipelines
+and the repository don't need to pass it around.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from bisect import bisect_left
+from contextlib import asynccontextmanager, suppress
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import aiohttp
+from aiohttp import web
+
+LabelValues = Tuple[Tuple[str, str], ...]
+
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _labels_key(labels: Dict[str, str]) -> LabelValues:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: LabelValues, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if (not pairs):
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_format_labels(labels)} {value}" for labels, value in self.values.items()]
+
+    def to_dict(self) -> list:
+        return [{"labels": dict(labels), "value": value} for labels, value in self.values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self.values[_labels_key(labels)] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, buckets: Tuple[float, ...] = default_buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        # labels -> [bucket counts..., +Inf count], sum
+        self.values: Dict[LabelValues, Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = _labels_key(labels)
+        counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+        counts[bisect_left(self.buckets, value)] += 1
+        self.values[key] = (counts, total + value)
+
+    def render(self) -> List[str]:
+        lines = []
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if (bound == float("inf")) else str(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(labels, ('le', le))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+    def to_dict(self) -> list:
+        return [
+            {
+                "labels": dict(labels),
+                "count": sum(counts),
+                "sum": total,
+                "buckets": dict(zip([str(bound) for bound in self.buckets] + ["+Inf"], counts)),
+            }
+            for labels, (counts, total) in self.values.items()
+        ]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+
+    def _get_or_create(self, cls, name: str, description: str, **kwargs):
+        if (name not in self.metrics):
+            self.metrics[name] = cls(name, description, **kwargs)
+        return self.metrics[name]
+
+    def counter(self, name: str, description: str) -> Counter:
+        return self._get_or_create(Counter, name, description)
+
+    def gauge(self, name: str, description: str) -> Gauge:
+        return self._get_or_create(Gauge, name, description)
+
+    def histogram(self, name: str, description: str, buckets: Tuple[float, ...] = default_buckets) -> Histogram:
+        return self._get_or_create(Histogram, name, description, buckets=buckets)
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> dict:
+        return {
+            "timestamp": time.time(),
+            "metrics": {name: metric.to_dict() for name, metric in self.metrics.items()},
+        }
+
+
+registry = MetricsRegistry()
+
+scraper_results = registry.counter(
+    "scraper_results_total",
+    "Fetched pages/videos by scraper and ResponseState"
+)
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds",
+    "Latency of HTTP requests by host and status"
+)
+db_commit_duration = registry.histogram(
+    "db_commit_duration_seconds",
+    "Latency of SongRepository commits by operation"
+)
+queue_depth = registry.gauge(
+    "queue_depth",
+    "Items waiting inside pipeline queues"
+)
+
+
+def metrics_trace_config() -> aiohttp.TraceConfig:
+    """
+    Records http_request_duration_seconds of every request made by the session.
+    """
+    trace = aiohttp.TraceConfig()
+
+    async def on_request_start(session, context, params):
+        context.started = time.perf_counter()
+
+    async def on_request_end(session, context, params):
+        http_request_duration.observe(
+            time.perf_counter() - context.started,
+            host=params.url.host,
+            status=params.response.status
+        )
+
+    async def on_request_exception(session, context, params):
+        http_request_duration.observe(
+            time.perf_counter() - context.started,
+            host=params.url.host,
+            status="error"
+        )
+
+    trace.on_request_start.append(on_request_start)
+    trace.on_request_end.append(on_request_end)
+    trace.on_request_exception.append(on_request_exception)
+    return trace
+
+
+async def start_metrics_server(port: int, host: str = "0.0.0.0") -> web.AppRunner:
+    """
+    Serves the registry in Prometheus text format on /metrics.
+    The returned runner should be cleaned up when the run is over.
+    """
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=registry.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
+
+
+def dump_metrics_json(path: str):
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(registry.to_dict(), file, indent=1)
+
+
+async def dump_metrics_periodically(path: str, interval: float = 30):
+    """
+    Overwrites path with a JSON snapshot of the registry every interval seconds until cancelled.
+    """
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            dump_metrics_json(path)
+    finally:
+        dump_metrics_json(path)
+
+
+def add_metrics_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve Prometheus metrics on this port")
+    parser.add_argument("--metrics-json", default=None, help="Periodically dump metrics as JSON into this file")
+    parser.add_argument("--metrics-interval", type=float, default=30, help="Seconds between JSON dumps")
+
+
+@asynccontextmanager
+async def metrics_reporting(args: argparse.Namespace) -> AsyncIterator[MetricsRegistry]:
+    """
+    Starts whatever add_metrics_arguments asked for and stops it when the block is left.
+    """
+    runner = None
+    dumper = None
+    if (args.metrics_port is not None):
+        runner = await start_metrics_server(args.metrics_port)
+    if (args.metrics_json):
+        dumper = asyncio.create_task(dump_metrics_periodically(args.metrics_json, args.metrics_interval))
+    try:
+        yield registry
+    finally:
+        if (dumper is not None):
+            dumper.cancel()
+            with suppress(asyncio.CancelledError):
+                await dumper
+        if (runner is not None):
+            await runner.cleanup()
@@ -0,0 +1,186 @@
+"""
+Opt-in per-stage profiling. Code marks stages with span(name), which costs
+nothing until profiling is started, and the collected wall time, CPU time and
+traced memory of every stage are written as JSON, so runs can be compared.
+Like the metrics, everything records into the module-level profiler.
+"""
+import argparse
+import cProfile
+import json
+import logging
+import pstats
+import sys
+import time
+import tracemalloc
+from contextlib import asynccontextmanager, nullcontext
+from typing import AsyncIterator, Dict, Optional
+
+_disabled_span = nullcontext()
+
+
+class StageStats:
+    """
+    net_traced_bytes is the change of traced memory across the spans, so memory
+    freed inside a span makes it negative. It isn't a count of allocations:
+    coroutines running concurrently with a span add to it too.
+    """
+    __slots__ = ("calls", "wall", "cpu", "net_traced")
+
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.net_traced = 0
+
+    def to_dict(self, trace_memory: bool) -> dict:
+        return {
+            "calls": self.calls,
+            "wall_seconds": round(self.wall, 6),
+            "cpu_seconds": round(self.cpu, 6),
+            "net_traced_bytes": self.net_traced if (trace_memory) else None,
+        }
+
+
+class Span:
+    __slots__ = ("profiler", "name", "wall", "cpu", "memory")
+
+    def __init__(self, profiler: "Profiler", name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.memory = tracemalloc.get_traced_memory()[0] if (self.profiler.trace_memory) else 0
+        self.cpu = time.process_time()
+        self.wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        stats = self.profiler.stages.get(self.name)
+        if (stats is None):
+            stats = self.profiler.stages[self.name] = StageStats()
+        stats.calls += 1
+        stats.wall += wall
+        stats.cpu += cpu
+        if (self.profiler.trace_memory):
+            stats.net_traced += tracemalloc.get_traced_memory()[0] - self.memory
+        return False
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.trace_memory = False
+        self.stages: Dict[str, StageStats] = {}
+        self.cprofile: Optional[cProfile.Profile] = None
+        self.started_wall = 0.0
+        self.started_cpu = 0.0
+        self.wall = 0.0
+        self.cpu = 0.0
+
+    def span(self, name: str):
+        """
+        Times the block as stage name. Stages are summed over calls, so concurrent
+        calls may add up to more than the run. CPU time is the process's, precise
+        for synchronous blocks, but shared with other coroutines across awaits.
+        """
+        if (not self.enabled):
+            return _disabled_span
+        return Span(self, name)
+
+    def start(self, cprofile: bool = False, trace_memory: bool = False):
+        self.stages = {}
+        self.trace_memory = trace_memory
+        if (trace_memory and not tracemalloc.is_tracing()):
+            tracemalloc.start()
+        if (cprofile):
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        self.started_wall = time.perf_counter()
+        self.started_cpu = time.process_time()
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+        self.wall = time.perf_counter() - self.started_wall
+        self.cpu = time.process_time() - self.started_cpu
+        if (self.cprofile is not None):
+            self.cprofile.disable()
+
+    def top_functions(self, limit: int = 40) -> list:
+        if (self.cprofile is None):
+            return []
+        stats = pstats.Stats(self.cprofile)
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:limit]
+        return [
+            {
+                "function": f"{filename}:{line}({name})",
+                "calls": calls,
+                "own_seconds": round(own, 6),
+                "cumulative_seconds": round(cumulative, 6),
+            }
+            for (filename, line, name), (_, calls, own, cumulative, _) in rows
+        ]
+
+    def to_dict(self) -> dict:
+        return {
+            "timestamp": time.time(),
+            "argv": sys.argv,
+            "wall_seconds": round(self.wall, 6),
+            "cpu_seconds": round(self.cpu, 6),
+            "peak_traced_bytes": tracemalloc.get_traced_memory()[1] if (self.trace_memory) else None,
+            "stages": {
+                name: stats.to_dict(self.trace_memory)
+                for name, stats in sorted(self.stages.items(), key=lambda item: item[1].wall, reverse=True)
+            },
+            "functions": self.top_functions(),
+        }
+
+    def dump(self, path: str):
+        """
+        Writes the breakdown into path, the raw cProfile stats (if any) into path.prof.
+        """
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.to_dict(), file, indent=1)
+        if (self.cprofile is not None):
+            self.cprofile.dump_stats(f"{path}.prof")
+
+
+profiler = Profiler()
+
+
+def span(name: str):
+    return profiler.span(name)
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--profile", default=None, help="Write a per-stage time breakdown as JSON into this file")
+    parser.add_argument(
+        "--profile-cprofile",
+        action="store_true",
+        help="Also run cProfile, its top functions go into the --profile file and the raw stats next to it"
+    )
+    parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        help="Also record the net change of traced memory per stage with tracemalloc (slows the run down)"
+    )
+
+
+@asynccontextmanager
+async def profile_reporting(args: argparse.Namespace) -> AsyncIterator[Profiler]:
+    """
+    Profiles the block if add_profile_arguments asked for it and writes the result when it's left.
+    """
+    if (not args.profile):
+        yield profiler
+        return
+
+    profiler.start(cprofile=args.profile_cprofile, trace_memory=args.profile_memory)
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        profiler.dump(args.profile)
+        logging.info(f"Wrote profile of {len(profiler.stages)} stages to {args.profile}")
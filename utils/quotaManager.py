@@ -0,0 +1,124 @@
+"""
+Per-key quota bookkeeping for APIs with daily unit budgets (YouTube Data API).
+Requests are spread over every healthy key, keys that ran out of quota are
+parked until the daily reset and rate limited keys only for a short while.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from utils.rateLimiter import AdaptiveRateLimiter, host_limits, default_limits
+
+try:
+    from zoneinfo import ZoneInfo
+    _quota_timezone = ZoneInfo("America/Los_Angeles")
+except Exception:
+    # Without tzdata (e.g. on Windows) the reset may be an hour off during DST
+    _quota_timezone = timezone(timedelta(hours=-8))
+
+
+class QuotaExhaustedError(RuntimeError):
+    """
+    Every key is parked for longer than the caller is willing to wait.
+    """
+
+
+def next_quota_reset(now: Optional[float] = None) -> float:
+    """
+    YouTube quotas reset at midnight Pacific Time, returns it as a timestamp.
+    """
+    moment = datetime.fromtimestamp(time.time() if (now is None) else now, _quota_timezone)
+    midnight = (moment + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return midnight.timestamp()
+
+
+class ApiKeyState:
+    __slots__ = ("key", "remaining", "parked_until", "in_flight", "rate_limiter")
+
+    def __init__(self, key: str, remaining: int, rate_limiter: AdaptiveRateLimiter):
+        self.key = key
+        self.remaining = remaining
+        self.parked_until = 0.0
+        self.in_flight = 0
+        self.rate_limiter = rate_limiter
+
+
+class QuotaManager:
+    def __init__(
+        self,
+        api_keys: List[str],
+        daily_quota: int = 10000,
+        rate_limiter: Optional[AdaptiveRateLimiter] = None,
+        host: str = "www.googleapis.com"
+    ):
+        """
+        daily_quota is the number of units of every key. Each key gets its own
+        rate limiter with the limits of host, unless a shared rate_limiter is given.
+        """
+        if (not api_keys):
+            raise ValueError("At least one API key is required")
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.setLevel(logging.DEBUG)
+
+        self.daily_quota = daily_quota
+        self.keys = [
+            ApiKeyState(
+                key,
+                daily_quota,
+                rate_limiter or AdaptiveRateLimiter(name=f"{host}#{i}", **host_limits.get(host, default_limits))
+            )
+            for i, key in enumerate(api_keys)
+        ]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def healthy_keys(self, now: Optional[float] = None) -> List[ApiKeyState]:
+        now = time.time() if (now is None) else now
+        healthy = []
+        for state in self.keys:
+            if (state.parked_until > now):
+                continue
+            if (state.remaining <= 0):
+                # Parked until the reset, which has passed by now
+                state.remaining = self.daily_quota
+            healthy.append(state)
+        return healthy
+
+    async def acquire(self, cost: int = 1, max_wait: float = 60) -> ApiKeyState:
+        """
+        Reserves cost units of the least busy healthy key, ties go to the key with
+        most quota left. If every key is parked, waits for the first one to come
+        back, or raises QuotaExhaustedError if that takes longer than max_wait.
+        Every acquire must be followed by release.
+        """
+        while True:
+            now = time.time()
+            healthy = self.healthy_keys(now)
+            if (healthy):
+                state = min(healthy, key=lambda state: (state.in_flight, -state.remaining))
+                state.in_flight += 1
+                state.remaining -= cost
+                if (state.remaining <= 0):
+                    self.park_until_reset(state)
+                return state
+
+            wait = min(state.parked_until for state in self.keys) - now
+            if (wait > max_wait):
+                raise QuotaExhaustedError(f"All {len(self.keys)} API keys are parked for {wait:.0f} more seconds")
+            await asyncio.sleep(wait)
+
+    def release(self, state: ApiKeyState):
+        state.in_flight -= 1
+
+    def park_until_reset(self, state: ApiKeyState):
+        state.remaining = 0
+        state.parked_until = next_quota_reset()
+        self.logger.info(f"Quota of key ...{state.key[-4:]} is exhausted, parked until the daily reset")
+
+    def park(self, state: ApiKeyState, seconds: float):
+        state.parked_until = max(state.parked_until, time.time() + seconds)
+        self.logger.debug(f"Key ...{state.key[-4:]} is parked for {seconds} seconds")
@@ -0,0 +1,98 @@
+"""
+Adaptive token bucket rate limiting shared by all scrapers.
+The rate of each bucket follows AIMD: it grows additively on successful
+responses and is cut multiplicatively on throttling (429/403/-412/UNKNOWN),
+so every service is kept just under its limit instead of bursting and stalling.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+
+class AdaptiveRateLimiter:
+    def __init__(
+        self,
+        rate: float,
+        min_rate: float = 0.2,
+        max_rate: Optional[float] = None,
+        burst: Optional[float] = None,
+        increase_step: float = 0.05,
+        decrease_factor: float = 0.5,
+        cooldown: float = 1.0,
+        name: str = ""
+    ):
+        """
+        rate, min_rate and max_rate are in requests per second.
+        increase_step is added to the rate on every success,
+        the rate is multiplied by decrease_factor at most once per cooldown seconds,
+        so a wave of throttled in-flight requests counts as a single signal.
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        self.name = name
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate * 4
+        self.burst = burst or max(1.0, rate)
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+
+        self._tokens = 1.0
+        self._updated_at = time.monotonic()
+        self._last_decrease = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self):
+        # Waiters queue on the lock, so tokens are handed out in FIFO order
+        async with self._lock:
+            while True:
+                self._refill()
+                if (self._tokens >= 1):
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def on_throttle(self):
+        now = time.monotonic()
+        if (now - self._last_decrease < self.cooldown):
+            return
+        self._last_decrease = now
+
+        self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+        self._refill()
+        self._tokens = min(self._tokens, 0)
+        self.logger.info(f"Throttled by {self.name or 'host'}, slowing down to {self.rate:.2f} req/sec")
+
+
+# Starting points per host, the limiters adapt from there
+host_limits: Dict[str, dict] = {
+    "vocadb.net": {"rate": 10, "max_rate": 20},
+    "www.googleapis.com": {"rate": 10, "max_rate": 50},
+    "ext.nicovideo.jp": {"rate": 20, "max_rate": 50},
+    # 20 req/sec get rate limited
+    "api.bilibili.com": {"rate": 5, "max_rate": 15},
+}
+default_limits = {"rate": 10}
+
+_limiters: Dict[str, AdaptiveRateLimiter] = {}
+
+
+def get_rate_limiter(url_or_host: str) -> AdaptiveRateLimiter:
+    """
+    Returns the limiter shared by every request to the host of the given URL.
+    """
+    host = urlparse(url_or_host).hostname or url_or_host
+    if (host not in _limiters):
+        _limiters[host] = AdaptiveRateLimiter(name=host, **host_limits.get(host, default_limits))
+    return _limiters[host]
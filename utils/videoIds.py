@@ -0,0 +1,84 @@
+"""
+Canonical video ids of PV URLs, so the same video shared by several songs
+(originals, reprints, covers) is requested once per (service, video_id).
+"""
+import re
+from typing import Optional
+from urllib.parse import urlparse, parse_qs
+
+from constants.services import Service, service_names_map
+
+youtube_id_pattern = re.compile(r"^[0-9A-Za-z_-]{11}$")
+niconico_id_pattern = re.compile(r"(sm|nm|so)[0-9]+")
+bilibili_bv_pattern = re.compile(r"BV[0-9a-zA-Z]{10}")
+bilibili_av_pattern = re.compile(r"av([0-9]+)", re.IGNORECASE)
+
+
+def _last_path_segment(url: str) -> str:
+    # Plain string splitting, urlparse is the slowest part of ingesting a page
+    return url.split('?', 1)[0].split('#', 1)[0].rstrip('/').rsplit('/', 1)[-1]
+
+
+def youtube_video_id(url: str) -> Optional[str]:
+    """
+    Examples:
+    https://youtu.be/P9l6Eg_Kk0g
+    https://www.youtube.com/watch?v=P9l6Eg_Kk0g
+    https://www.youtube.com/embed/P9l6Eg_Kk0g
+    """
+    segment = _last_path_segment(url)
+    if (youtube_id_pattern.match(segment)):
+        return segment
+    candidates = parse_qs(urlparse(url).query).get("v", []) if ('?' in url) else []
+    for candidate in candidates:
+        if (youtube_id_pattern.match(candidate)):
+            return candidate
+    return None
+
+
+def niconico_video_id(url: str) -> Optional[str]:
+    """
+    Example: http://www.nicovideo.jp/watch/sm45326679
+    """
+    segment = _last_path_segment(url)
+    search = niconico_id_pattern.search(segment)
+    if (search is not None):
+        return search.group(0)
+    return segment or None
+
+
+def bilibili_video_id(url: str) -> Optional[str]:
+    """
+    Examples:
+    https://www.bilibili.com/video/av114962936629968
+    https://www.bilibili.com/video/BV1xx411c7mD
+
+    av ids are kept as they are: utils.bvid conversion isn't valid for the newer, large aids.
+    """
+    search_bv = bilibili_bv_pattern.search(url)
+    if (search_bv is not None):
+        return search_bv.group(0)
+    search_av = bilibili_av_pattern.search(url)
+    if (search_av is not None):
+        return f"av{search_av.group(1)}"
+    return None
+
+
+_extractors = {
+    service_names_map[Service.YOUTUBE]: youtube_video_id,
+    service_names_map[Service.NICONICO]: niconico_video_id,
+    service_names_map[Service.BILIBILI]: bilibili_video_id,
+}
+
+
+def canonical_video_id(service: Optional[str], url: Optional[str]) -> Optional[str]:
+    """
+    Returns the id used to request statistics of the video, None if it can't be parsed.
+    URLs of services without a dedicated extractor fall back to the last path segment.
+    """
+    if (not url):
+        return None
+    extractor = _extractors.get(service)
+    if (extractor is None):
+        return _last_path_segment(url) or None
+    return extractor(url)